@@ -17,11 +17,11 @@ from hashlib import sha256
 import sys
 from io import open
 
-import boto3
-import requests
-from botocore.exceptions import ClientError
 from tqdm import tqdm
 
+# boto3 / requests are imported where they are used: loading local model
+# directories never touches them, and importing them costs seconds.
+
 try:
     from torch.hub import _get_torch_home
     torch_cache_home = _get_torch_home()
@@ -145,6 +145,7 @@ def s3_request(func):
 
     @wraps(func)
     def wrapper(url, *args, **kwargs):
+        from botocore.exceptions import ClientError
         try:
             return func(url, *args, **kwargs)
         except ClientError as exc:
@@ -159,6 +160,7 @@ def s3_request(func):
 @s3_request
 def s3_etag(url):
     """Check ETag on S3 object."""
+    import boto3
     s3_resource = boto3.resource("s3")
     bucket_name, s3_path = split_s3_path(url)
     s3_object = s3_resource.Object(bucket_name, s3_path)
@@ -168,12 +170,14 @@ def s3_etag(url):
 @s3_request
 def s3_get(url, temp_file):
     """Pull a file directly from S3."""
+    import boto3
     s3_resource = boto3.resource("s3")
     bucket_name, s3_path = split_s3_path(url)
     s3_resource.Bucket(bucket_name).download_fileobj(s3_path, temp_file)
 
 
 def http_get(url, temp_file):
+    import requests
     req = requests.get(url, stream=True)
     content_length = req.headers.get('Content-Length')
     total = int(content_length) if content_length is not None else None
@@ -202,6 +206,7 @@ def get_from_cache(url, cache_dir=None):
     if url.startswith("s3://"):
         etag = s3_etag(url)
     else:
+        import requests
         try:
             response = requests.head(url, allow_redirects=True)
             if response.status_code != 200:
@@ -3,12 +3,11 @@
 import codecs as cs
 import os
 import sys
-import pdb
-sys.path.insert(0, '/mnt/nfs-storage-titan/BERT/pytorch_pretrained_BERT')
-from pytorch_pretrained_bert.tokenization import BertTokenizer
 
 def read_pair_gold(f, args):
     # key: text + aspect span + opinion span; value: corresponding category-sentiment type number
+    # same tokenizer as run_step2.py, imported here so importing this module stays cheap
+    from bert_utils.tokenization import BertTokenizer
 
     tokenizer = BertTokenizer.from_pretrained(args.bert_model, do_lower_case=args.do_lower_case)
     quad_text = []
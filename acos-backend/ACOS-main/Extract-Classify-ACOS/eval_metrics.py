@@ -8,7 +8,6 @@ import os
 import sys
 import random
 from tqdm import tqdm, trange
-import pdb
 import warnings
 import codecs as cs
 import copy
@@ -20,7 +19,7 @@ import numpy as np
 import torch
 from torch.nn import CrossEntropyLoss, MSELoss, MultiLabelSoftMarginLoss, BCEWithLogitsLoss
 
-from run_classifier_dataset_utils import compute_metrics
+from run_classifier_dataset_utils import compute_metrics, LengthSortedBatchSampler
 
 def measureQuad(pred, gold):
     tp = .0
@@ -88,6 +87,9 @@ def pred_eval(_e, args, logger, tokenizer, model, dataloader, eval_gold, label_l
             print(step)
 
         _all_tokens_len += batch[0].numpy().tolist()
+        # dynamic padding: attend only up to the longest example of the batch
+        max_len = int(batch[0].max())
+        batch = tuple(t[:, :max_len] if t.dim() > 1 else t for t in batch)
         batch = tuple(t.to(device) for t in batch)
         _tokens_len, _aspect_input_ids, _aspect_input_mask, _aspect_ids, _aspect_segment_ids, \
                 _exist_imp_aspect, _exist_imp_opinion = batch
@@ -109,6 +111,13 @@ def pred_eval(_e, args, logger, tokenizer, model, dataloader, eval_gold, label_l
             for i, ele in enumerate(logits_imp_opinion):
                 pred_imp_opinion.append(ele)
 
+    if isinstance(dataloader.batch_sampler, LengthSortedBatchSampler):
+        restore_order = dataloader.batch_sampler.restore_order
+        pred_aspect_tag = restore_order(pred_aspect_tag)
+        pred_imp_aspect = restore_order(pred_imp_aspect)
+        pred_imp_opinion = restore_order(pred_imp_opinion)
+        _all_tokens_len = restore_order(_all_tokens_len)
+
     for i in range(len(pred_aspect_tag)):
         cur_aspect_tag = ''.join(str(ele) for ele in pred_aspect_tag[i])
         pred_tag = []
@@ -220,6 +229,20 @@ def measureQuad_imp(pred, gold, text_type):
         print(i, ': ', {'precision':p, 'recall':r, 'micro-F1':f})
     return {'precision':p, 'recall':r, 'micro-F1':f}
 
+def unique_sentence_rows(aspect_input_ids):
+    """Returns (rows, pair_index): the first batch row of each distinct sentence, and for every
+    row the position of its sentence in `rows`."""
+    first_row = {}
+    pair_index = []
+    for row, ids in enumerate(aspect_input_ids.tolist()):
+        key = tuple(ids)
+        if key not in first_row:
+            first_row[key] = len(first_row), row
+        pair_index.append(first_row[key][0])
+    rows = [row for _, row in sorted(first_row.values())]
+    device = aspect_input_ids.device
+    return torch.tensor(rows, dtype=torch.long, device=device), torch.tensor(pair_index, dtype=torch.long, device=device)
+
 def pair_eval(_e, args, logger, tokenizer, model, dataloader, gold, label_list, device, task_name, eval_type='valid'):
     preds = {}
     golds = {}
@@ -256,9 +279,15 @@ def pair_eval(_e, args, logger, tokenizer, model, dataloader, gold, label_list,
 
         # define a new function to compute loss values for both output_modes
         with torch.no_grad():
-            loss, logits = model(tokenizer, _e, aspect_input_ids=_aspect_input_ids,
-                    aspect_token_type_ids=_aspect_segment_ids, aspect_attention_mask=_aspect_input_mask,
-                    candidate_aspect=_candidate_aspect, candidate_opinion=_candidate_opinion, label_id=_label_id)
+            if getattr(args, 'encode_once', False):
+                # rows of one sentence only differ in their candidate masks: encode each sentence once
+                sentence_rows, pair_index = unique_sentence_rows(_aspect_input_ids)
+                logits = [model.classify_shared(_aspect_input_ids[sentence_rows], _aspect_segment_ids[sentence_rows],
+                    _aspect_input_mask[sentence_rows], pair_index, _candidate_aspect, _candidate_opinion)]
+            else:
+                loss, logits = model(tokenizer, _e, aspect_input_ids=_aspect_input_ids,
+                        aspect_token_type_ids=_aspect_segment_ids, aspect_attention_mask=_aspect_input_mask,
+                        candidate_aspect=_candidate_aspect, candidate_opinion=_candidate_opinion, label_id=_label_id)
 
         logits = logits[0].detach().cpu().numpy()
         # pair_matrix = logits[0].view(len(_tokens_len), logits[1].item(), logits[1].item(), 3).detach().cpu().numpy()
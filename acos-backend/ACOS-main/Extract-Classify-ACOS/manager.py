@@ -13,7 +13,7 @@ with gm.auto_choice():
 '''
 
 import os
-import pdb
+import shutil
 import sched, time
 import datetime
 #from tensorflow.python.client import device_lib
@@ -166,3 +166,25 @@ class GPUManager():
         return index
 # else:
 #     raise ImportError('GPU available check failed')
+
+def select_visible_gpu():
+    '''
+    return:
+        the chosen GPU index, or None when running on CPU
+    Run-time, non-blocking replacement for GPUManager().auto_choice(mode=0):
+    pins CUDA_VISIBLE_DEVICES to the GPU with the largest free memory.
+    Must run before torch initializes CUDA. Returns immediately on hosts
+    without nvidia-smi, and never waits for a GPU to become free.
+    An existing CUDA_VISIBLE_DEVICES is respected.
+    '''
+    if 'CUDA_VISIBLE_DEVICES' in os.environ:
+        return os.environ['CUDA_VISIBLE_DEVICES'] or None
+    if shutil.which('nvidia-smi') is None:
+        return None
+    gpus = query_gpu()
+    if not gpus:
+        return None
+    index = sorted(gpus, key=lambda d: d['memory.free'], reverse=True)[0]['index']
+    os.environ['CUDA_VISIBLE_DEVICES'] = str(index)
+    print('Using GPU {}'.format(index))
+    return index
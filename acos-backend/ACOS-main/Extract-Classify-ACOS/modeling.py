@@ -23,7 +23,6 @@ import logging
 import math
 import os
 import sys
-import pdb
 from io import open
 
 import torch
@@ -94,6 +93,15 @@ def prune_linear_layer(layer, index, dim=0):
     return new_layer
 
 
+def quantize_bert_dynamic(model):
+    """ Int8 dynamic quantization of the nn.Linear layers of `model.bert`, in place.
+        Weights are stored as int8 and activations quantized on the fly, which roughly halves
+        CPU inference time and shrinks the encoder's resident memory. CPU inference only.
+    """
+    torch.quantization.quantize_dynamic(model.bert, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+
 def load_tf_weights_in_bert(model, tf_checkpoint_path):
     """ Load tf checkpoints in a pytorch model
     """
@@ -1567,6 +1575,21 @@ class BertForQuadABSA(BertPreTrainedModel):
 
         self.apply(self.init_bert_weights)
 
+    def _emissions(self, aspect_input_ids, aspect_token_type_ids, aspect_attention_mask):
+        pooled_outputs, pooled_output = self.bert(aspect_input_ids, aspect_token_type_ids, aspect_attention_mask,
+        output_all_encoded_layers=False, head_mask=None)
+
+        # implicit aspect, opinion classification
+        imp_aspect_exist = self.imp_asp_classifier(pooled_output)
+        # arange rather than range() keeps the batch size dynamic when the module is traced
+        batch_index = torch.arange(pooled_outputs.size(0), device=pooled_outputs.device)
+        imp_opinion_exist = self.imp_opi_classifier(pooled_outputs[batch_index, torch.sum(aspect_attention_mask, dim=-1)-1])
+
+        max_seq_len = aspect_input_ids.size()[1]
+        sequence_output = self.dense_output(pooled_outputs)
+        sequence_output = sequence_output.view(-1, max_seq_len, self.crf_num)
+        return sequence_output, imp_aspect_exist, imp_opinion_exist
+
     def forward(self, aspect_input_ids, aspect_labels,
                 aspect_token_type_ids, aspect_attention_mask,
                 exist_imp_aspect, exist_imp_opinion):
@@ -1575,23 +1598,13 @@ class BertForQuadABSA(BertPreTrainedModel):
         #     if parameters.size()[0] < 2:
         #         print(name,':',parameters)
 
-        pooled_outputs, pooled_output = self.bert(aspect_input_ids, aspect_token_type_ids, aspect_attention_mask,
-        output_all_encoded_layers=False, head_mask=None)
-
-        bs = pooled_output.shape[0]
-        hidden_size = pooled_output.shape[-1]
+        sequence_output, imp_aspect_exist, imp_opinion_exist = self._emissions(
+            aspect_input_ids, aspect_token_type_ids, aspect_attention_mask)
 
-        # implicit aspect, opinion classification
         loss_fct = CrossEntropyLoss()
-        imp_aspect_exist = self.imp_asp_classifier(pooled_output)
-        imp_opinion_exist = self.imp_opi_classifier(pooled_outputs[range(pooled_outputs.shape[0]), torch.sum(aspect_attention_mask, dim=-1)-1])
-
         imp_aspect_loss = loss_fct(imp_aspect_exist, exist_imp_aspect.view(-1))
         imp_opinion_loss = loss_fct(imp_opinion_exist, exist_imp_opinion.view(-1))
 
-        max_seq_len = aspect_input_ids.size()[1]
-        sequence_output = self.dense_output(pooled_outputs)
-        sequence_output = sequence_output.view(-1, max_seq_len, self.crf_num)
         ae_loss = - self.crf(sequence_output, aspect_labels, mask=aspect_attention_mask.byte(), reduction='mean')
         pred_tags = self.crf.decode(sequence_output, mask=aspect_attention_mask.byte())
 
@@ -1622,26 +1635,48 @@ class CategorySentiClassification(BertPreTrainedModel):
 
         self.apply(self.init_bert_weights)
 
-    def forward(self, tokenizer, _e, aspect_input_ids,
-                aspect_token_type_ids, aspect_attention_mask,
-                candidate_aspect, candidate_opinion, label_id):
+    def classify(self, aspect_input_ids, aspect_token_type_ids, aspect_attention_mask,
+                 candidate_aspect, candidate_opinion):
+        """Inference-only path: category-sentiment logits of each candidate pair, no loss."""
+        aspect_input_ids, aspect_token_type_ids, aspect_attention_mask, candidate_aspect, candidate_opinion = \
+            self._trim_to_longest(aspect_input_ids, aspect_token_type_ids, aspect_attention_mask,
+                                  candidate_aspect, candidate_opinion)
+
+        pooled_outputs, pooled_output = self.bert(aspect_input_ids, aspect_token_type_ids, aspect_attention_mask,
+        output_all_encoded_layers=False, head_mask=None)
+
+        return self._pair_logits(pooled_outputs, candidate_aspect, candidate_opinion)
 
-        aspect_seq_len = torch.max(torch.sum(aspect_attention_mask, dim=-1))
-        max_seq_len = aspect_seq_len
-        aspect_input_ids = aspect_input_ids[:, :max_seq_len].contiguous()
-        aspect_token_type_ids = aspect_token_type_ids[:, :max_seq_len].contiguous()
-        aspect_attention_mask = aspect_attention_mask[:, :max_seq_len].contiguous()
-        candidate_aspect = candidate_aspect[:, :max_seq_len].contiguous()
-        candidate_opinion = candidate_opinion[:, :max_seq_len].contiguous()
+    def classify_shared(self, aspect_input_ids, aspect_token_type_ids, aspect_attention_mask,
+                        pair_index, candidate_aspect, candidate_opinion):
+        """Encode-once variant of `classify`.
 
+        `aspect_input_ids` holds one row per distinct sentence and `pair_index[k]` is the row of
+        candidate pair k, so each sentence runs through BERT once however many (aspect, opinion)
+        pairs it has; the span representations of all pairs are gathered from the shared states.
+        """
+        aspect_input_ids, aspect_token_type_ids, aspect_attention_mask, candidate_aspect, candidate_opinion = \
+            self._trim_to_longest(aspect_input_ids, aspect_token_type_ids, aspect_attention_mask,
+                                  candidate_aspect, candidate_opinion)
 
         pooled_outputs, pooled_output = self.bert(aspect_input_ids, aspect_token_type_ids, aspect_attention_mask,
         output_all_encoded_layers=False, head_mask=None)
 
+        return self._pair_logits(pooled_outputs[pair_index], candidate_aspect, candidate_opinion)
 
-        bs = pooled_output.shape[0]
-        hidden_size = pooled_output.shape[-1]
-        
+    @staticmethod
+    def _trim_to_longest(aspect_input_ids, aspect_token_type_ids, aspect_attention_mask,
+                         candidate_aspect, candidate_opinion):
+        # cut the padding beyond the longest sequence of the batch
+        max_seq_len = torch.max(torch.sum(aspect_attention_mask, dim=-1))
+        return (aspect_input_ids[:, :max_seq_len].contiguous(),
+                aspect_token_type_ids[:, :max_seq_len].contiguous(),
+                aspect_attention_mask[:, :max_seq_len].contiguous(),
+                candidate_aspect[:, :max_seq_len].contiguous(),
+                candidate_opinion[:, :max_seq_len].contiguous())
+
+    def _pair_logits(self, pooled_outputs, candidate_aspect, candidate_opinion):
+        hidden_size = pooled_outputs.shape[-1]
 
         candidate_aspect_sum = torch.sum(candidate_aspect, -1).float()
         aspect_denominator = (candidate_aspect_sum+candidate_aspect_sum.eq(0).float()).unsqueeze(-1).repeat(1, hidden_size)
@@ -1653,6 +1688,14 @@ class CategorySentiClassification(BertPreTrainedModel):
 
         fused_feature = torch.cat([candidate_aspect_rep, candidate_opinion_rep], -1)
         fused_feature = self.classifier(self.dropout(fused_feature))
+        return fused_feature
+
+    def forward(self, tokenizer, _e, aspect_input_ids,
+                aspect_token_type_ids, aspect_attention_mask,
+                candidate_aspect, candidate_opinion, label_id):
+
+        fused_feature = self.classify(aspect_input_ids, aspect_token_type_ids, aspect_attention_mask,
+                                      candidate_aspect, candidate_opinion)
         cate_loss_fct = BCEWithLogitsLoss()
         loss = cate_loss_fct(fused_feature.view(-1, self.num_labels[0]), label_id.view(-1, self.num_labels[0]).float() )
         # pair_loss = loss_fct(pred_matrix, pair_matrix.view(-1))
@@ -20,16 +20,10 @@ from __future__ import absolute_import, division, print_function
 import csv
 import logging
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 import os
 import copy
-import pdb
 import sys
 
-from scipy.stats import pearsonr, spearmanr
-from sklearn.metrics import matthews_corrcoef, f1_score, hamming_loss, precision_score, recall_score
-
 logger = logging.getLogger(__name__)
 
 
@@ -177,6 +171,7 @@ class QuadProcessor(DataProcessor):
             try:
                 text_a = line[0]
             except:
+                import pdb
                 pdb.set_trace()
             labels = line[1:]
             examples.append(
@@ -527,11 +522,38 @@ def _truncate_seq_pair2nd(tokens_a, max_length):
         tokens_a.pop()
 
 
+class LengthSortedBatchSampler(object):
+    """Batch sampler for inference that groups examples of similar `tokens_len`.
+
+    Batches are yielded shortest first, so trimming each batch to its longest example
+    removes most of the padding. `order[k]` is the dataset index of the k-th example
+    in iteration order, used to put predictions back in input order.
+    """
+
+    def __init__(self, tokens_len, batch_size):
+        self.order = sorted(range(len(tokens_len)), key=lambda i: tokens_len[i])
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        for start in range(0, len(self.order), self.batch_size):
+            yield self.order[start:start + self.batch_size]
+
+    def __len__(self):
+        return (len(self.order) + self.batch_size - 1) // self.batch_size
+
+    def restore_order(self, values):
+        restored = [None] * len(values)
+        for position, index in enumerate(self.order):
+            restored[index] = values[position]
+        return restored
+
+
 def simple_accuracy(preds, labels):
     return (preds == labels).mean()
 
 
 def acc_and_f1(preds, labels):
+    from sklearn.metrics import f1_score, hamming_loss, precision_score, recall_score
     acc = simple_accuracy(preds, labels)
     precision = precision_score(labels, preds, average='micro')
     recall = recall_score(labels, preds, average='micro')
@@ -550,6 +572,7 @@ def acc_and_f1(preds, labels):
 
 
 def pearson_and_spearman(preds, labels):
+    from scipy.stats import pearsonr, spearmanr
     pearson_corr = pearsonr(preds, labels)[0]
     spearman_corr = spearmanr(preds, labels)[0]
     return {
@@ -24,17 +24,10 @@ import torch
 import sys
 import random
 from tqdm import tqdm, trange
-import pdb
 from collections import defaultdict, namedtuple
-from manager import *
+from manager import select_visible_gpu
 import math
 import codecs as cs
-from sklearn.model_selection import KFold
-
-gm = GPUManager()
-device = gm.auto_choice(mode=0)
-# device = torch.device('cpu')
-os.environ["CUDA_VISIBLE_DEVICES"] = str(device)
 
 import numpy as np
 
@@ -44,7 +37,7 @@ from torch.utils.data import (DataLoader, RandomSampler, SequentialSampler,
 from torch.utils.data.distributed import DistributedSampler
 from torch.nn import CrossEntropyLoss, MSELoss, MultiLabelSoftMarginLoss, BCEWithLogitsLoss
 
-from modeling import BertForQuadABSA
+from modeling import BertForQuadABSA, quantize_bert_dynamic
 from bert_utils.tokenization import BertTokenizer
 from bert_utils.optimization import BertAdam, WarmupLinearSchedule
 
@@ -52,10 +45,6 @@ from run_classifier_dataset_utils import *
 from eval_metrics import *
 import gc
 
-if sys.version_info[0] == 2:
-    import cPickle as pickle
-else:
-    import pickle
 
 CONFIG_NAME = "config.json"
 WEIGHTS_NAME = "pytorch_model.bin"
@@ -165,8 +154,15 @@ def main():
                         help="Loss scaling to improve fp16 numeric stability. Only used when fp16 set to True.\n"
                              "0 (default value): dynamic loss scaling.\n"
                              "Positive power of 2: static loss scaling value.\n")
+    parser.add_argument('--quantize',
+                        action='store_true',
+                        help="Evaluate with int8 dynamic quantization of the BERT linear layers (CPU only).")
     args = parser.parse_args()
 
+    if not (args.no_cuda or args.quantize):
+        # pick the freest GPU before torch initializes CUDA; no-op on CPU-only hosts
+        select_visible_gpu()
+
     if args.local_rank == -1 or args.no_cuda:
         device = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
         n_gpu = torch.cuda.device_count()
@@ -176,6 +172,10 @@ def main():
         n_gpu = 1
         # Initializes the distributed backend which will take care of sychronizing nodes/GPUs
         torch.distributed.init_process_group(backend='nccl')
+    if args.quantize:
+        # int8 dynamic quantized kernels only run on CPU
+        device = torch.device("cpu")
+        n_gpu = 0
     args.device = device
 
     logging.basicConfig(format = '%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
@@ -281,10 +281,12 @@ def main():
         eval_aspect_segment_ids, eval_exist_imp_aspect, eval_exist_imp_opinion)
         # Run prediction for full data
         if args.local_rank == -1:
-            eval_sampler = SequentialSampler(eval_data)
+            # batch similar lengths together; pred_eval trims each batch and restores the input order
+            eval_dataloader = DataLoader(eval_data,
+                batch_sampler=LengthSortedBatchSampler(eval_tokens_len.tolist(), args.eval_batch_size))
         else:
             eval_sampler = DistributedSampler(eval_data)  # Note that this sampler samples randomly
-        eval_dataloader = DataLoader(eval_data, sampler=eval_sampler, batch_size=args.eval_batch_size)
+            eval_dataloader = DataLoader(eval_data, sampler=eval_sampler, batch_size=args.eval_batch_size)
 
     if args.do_train:
 
@@ -375,10 +377,11 @@ def main():
         valid_data = TensorDataset(valid_tokens_len, valid_aspect_input_ids, valid_aspect_input_mask,
         valid_aspect_ids, valid_aspect_segment_ids, valid_exist_imp_aspect, valid_exist_imp_opinion)
         if args.local_rank == -1:
-            valid_sampler = SequentialSampler(valid_data)
+            valid_dataloader = DataLoader(valid_data,
+                batch_sampler=LengthSortedBatchSampler(valid_tokens_len.tolist(), args.eval_batch_size))
         else:
             valid_sampler = DistributedSampler(valid_data)
-        valid_dataloader = DataLoader(valid_data, sampler=valid_sampler, batch_size=args.eval_batch_size)
+            valid_dataloader = DataLoader(valid_data, sampler=valid_sampler, batch_size=args.eval_batch_size)
 
         num_train_optimization_steps = math.ceil(len(train_dataloader) / args.gradient_accumulation_steps) * args.num_train_epochs
 
@@ -467,6 +470,8 @@ def main():
 
         if args.fp16:
             model.half()
+        if args.quantize:
+            quantize_bert_dynamic(model)
 
         model.to(device)
         model.eval()
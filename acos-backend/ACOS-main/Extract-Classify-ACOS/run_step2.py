@@ -7,19 +7,12 @@ import sys
 import random
 import torch
 from tqdm import tqdm, trange
-import pdb
 from collections import defaultdict, namedtuple
-from manager import *
+from manager import select_visible_gpu
 import math
 import codecs as cs
-from sklearn.model_selection import KFold
 from dataset_utils import *
 
-gm = GPUManager()
-device = gm.auto_choice(mode=0)
-# device = torch.device('cpu')
-os.environ["CUDA_VISIBLE_DEVICES"] = str(device)
-
 import numpy as np
 
 import torch
@@ -27,7 +20,7 @@ from torch.utils.data import (DataLoader, RandomSampler, SequentialSampler,
                               TensorDataset)
 from torch.nn import CrossEntropyLoss, MSELoss, MultiLabelSoftMarginLoss, BCEWithLogitsLoss
 
-from modeling import CategorySentiClassification
+from modeling import CategorySentiClassification, quantize_bert_dynamic
 
 # sys.path.insert(0, '/home/hjcai/8RTX/BERT/pytorch_pretrained_BERT')
 # from modeling_for_share import BertForQuadABSAPairCSAO
@@ -38,10 +31,6 @@ from run_classifier_dataset_utils import *
 from eval_metrics import *
 import gc
 
-if sys.version_info[0] == 2:
-    import cPickle as pickle
-else:
-    import pickle
 import warnings
 
 warnings.filterwarnings('ignore')
@@ -132,10 +121,27 @@ def main():
                         type=int,
                         default=1,
                         help="Number of updates steps to accumulate before performing a backward/update pass.")
+    parser.add_argument('--encode_once',
+                        action='store_true',
+                        help="At evaluation, encode each sentence once and classify all its candidate "
+                             "aspect-opinion pairs from the shared hidden states.")
+    parser.add_argument("--no_cuda",
+                        action='store_true',
+                        help="Whether not to use CUDA when available")
+    parser.add_argument('--quantize',
+                        action='store_true',
+                        help="Evaluate with int8 dynamic quantization of the BERT linear layers (CPU only).")
     
     args = parser.parse_args()
-    device = torch.device("cuda")
-    n_gpu = torch.cuda.device_count()
+    if not (args.no_cuda or args.quantize):
+        # pick the freest GPU before torch initializes CUDA; no-op on CPU-only hosts
+        select_visible_gpu()
+    device = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
+    n_gpu = torch.cuda.device_count() if device.type == 'cuda' else 0
+    if args.quantize:
+        # int8 dynamic quantized kernels only run on CPU
+        device = torch.device("cpu")
+        n_gpu = 0
 
     logging.basicConfig(format = '%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
                         datefmt = '%m/%d/%Y %H:%M:%S',
@@ -332,6 +338,8 @@ def main():
         model = model_dict[args.model_type].from_pretrained(args.bert_model, num_labels=num_labels)
         if args.local_rank == 0:
             torch.distributed.barrier()
+        if args.quantize:
+            quantize_bert_dynamic(model)
 
         model.to(device)
         model.eval()
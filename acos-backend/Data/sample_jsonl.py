@@ -1,34 +1,185 @@
-import random
+import os
+import sys
+import heapq
+import hashlib
+import argparse
 
-original_file = 'Appliances.jsonl'  # 원본 파일 경로
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from review_reader import iter_lines, map_blocks, input_size, json_loads
+from review_index import open_index, read_records
+
+original_file = 'Appliances.jsonl'  # 원본 파일 경로 (.jsonl.gz / .jsonl.bz2 / .jsonl.zst 도 압축 해제 없이 읽습니다)
 new_file = 'Appliances_trimmed.jsonl'    # 저장할 파일 경로
-sample_ratio = 0.05                   # 25% 샘플링
-
-# 파일을 한 줄씩 읽어서 처리하므로 메모리 문제가 없습니다.
-try:
-    with open(original_file, 'r', encoding='utf-8') as f_in, \
-         open(new_file, 'w', encoding='utf-8') as f_out:
-        
-        processed_lines = 0
-        saved_lines = 0
-        
-        for line in f_in:
-            processed_lines += 1
-            
-            # 25% 확률로 현재 줄을 선택합니다.
-            if random.random() < sample_ratio:
-                f_out.write(line)
-                saved_lines += 1
-            
-            # 진행 상황 표시 (선택 사항)
-            if processed_lines % 100000 == 0:
+sample_ratio = 0.05                   # 5% 샘플링 (-n 을 주면 정확히 N 줄)
+sample_seed = 42                      # 같은 seed 면 같은 샘플
+
+
+# 줄마다 (seed, 바이트 위치) 로 정해지는 [0, 1) 난수.
+# 블록 크기, 프로세스 수, 압축 여부와 상관없이 같은 파일이면 같은 줄이 뽑힙니다.
+def line_key(seed: int, offset: int) -> float:
+    digest = hashlib.blake2b(offset.to_bytes(8, 'little'), digest_size=8,
+                             key=seed.to_bytes(8, 'little', signed=True)).digest()
+    return int.from_bytes(digest, 'little') / 2 ** 64
+
+
+def stratum_of(line: bytes, field: str):
+    try:
+        value = json_loads(line).get(field)
+    except Exception:
+        return None
+    # 빈 값도 층을 알 수 없는 줄로 셉니다 (인덱스의 asin 그룹과 같은 기준)
+    return None if value is None else str(value).strip() or None
+
+
+def _keep(heap, size, key, item):
+    # 키가 가장 작은 size 개만 유지 (max-heap: 키에 - 를 붙여 저장)
+    if len(heap) < size:
+        heapq.heappush(heap, (-key, item))
+    elif -heap[0][0] > key:
+        heapq.heapreplace(heap, (-key, item))
+
+
+# 블록 하나를 샘플링: (읽은 줄 수, 층을 알 수 없는 줄 수, 뽑힌 것들)
+#  - 비율 모드: [(offset, line)]
+#  - N 모드: {층: [(-key, (offset, line))]}  (층 없이 뽑으면 층은 None 하나)
+def sample_block(path, start, end, seed, ratio, size, field):
+    lines = 0
+    unknown = 0
+    selected = [] if size is None else {}
+    for line, line_end in iter_lines(path, start, end):
+        if not line.strip():
+            continue
+        lines += 1
+        offset = line_end - len(line)
+        key = line_key(seed, offset)
+        if size is None:
+            if key < ratio:
+                selected.append((offset, line))
+            continue
+        stratum = None
+        if field:
+            stratum = stratum_of(line, field)
+            if stratum is None:
+                unknown += 1
+                continue
+        _keep(selected.setdefault(stratum, []), size, key, (offset, line))
+    return lines, unknown, selected
+
+
+# 인덱스(<파일>.idx)로 뽑을 줄의 위치만 고르기: (전체 줄 수, 층을 알 수 없는 줄 수, 파일 순서의 offset)
+# 줄마다의 난수가 offset 으로만 정해지므로 파일을 스캔한 결과와 같은 줄이 뽑힙니다.
+def sample_index(index, seed, ratio, size, field):
+    if size is None:
+        # 비율 모드: offset 을 순서대로 흘려보내서 바로 읽고 저장
+        offsets = (offset for block in index.iter_offsets() for offset in block if line_key(seed, offset) < ratio)
+        return len(index), 0, offsets
+    heaps = []
+    unknown = 0
+    if field:
+        # asin 층: 인덱스의 asin 그룹마다 상위 N
+        for _, group in index.iter_asins():
+            heap = []
+            for offset in group:
+                _keep(heap, size, line_key(seed, offset), offset)
+            heaps.append(heap)
+            unknown -= len(group)
+        unknown += len(index)
+    else:
+        heap = []
+        for block in index.iter_offsets():
+            for offset in block:
+                _keep(heap, size, line_key(seed, offset), offset)
+        heaps.append(heap)
+    return len(index), unknown, sorted(offset for heap in heaps for _, offset in heap)
+
+
+def sample_file(path, out_path, seed=sample_seed, ratio=sample_ratio, size=None, field=None, processes=0,
+                block_bytes=8 * 2 ** 20, use_index=True):
+    # 인덱스가 있고 최신이면 (층 없이, 또는 asin 층) 파일 전체를 읽지 않고 뽑힌 줄만 읽습니다
+    index = open_index(path, require_asins=bool(field)) if use_index and field in (None, 'asin') else None
+    if index is not None:
+        try:
+            processed_lines, unknown_lines, offsets = sample_index(index, seed, ratio, size, field)
+            print(f"인덱스 사용: {index.path}")
+            with open(out_path, 'wb') as f_out:
+                saved_lines = write_lines(f_out, read_records(path, offsets, presorted=True))
+        finally:
+            index.close()
+        return processed_lines, saved_lines, unknown_lines
+
+    file_size = input_size(path)
+    if file_size is None:
+        # 압축 파일은 블록으로 나눌 수 없어서 한 스트림으로 읽습니다
+        blocks = [sample_block(path, 0, None, seed, ratio, size, field)]
+    else:
+        blocks = map_blocks(sample_block, path, 0, file_size, processes, block_bytes, seed, ratio, size, field)
+
+    processed_lines = 0
+    unknown_lines = 0
+    saved_lines = 0
+    next_report = 100000
+    sampled = {}
+    with open(out_path, 'wb') as f_out:
+        for lines, unknown, selected in blocks:
+            processed_lines += lines
+            unknown_lines += unknown
+            if size is None:
+                # 블록이 파일 순서대로 오므로 바로 저장 (샘플 크기만큼 메모리를 쓰지 않습니다)
+                saved_lines += write_lines(f_out, selected)
+            else:
+                # 블록별 상위 N 을 합쳐도 전체 상위 N 과 같습니다
+                for stratum, heap in selected.items():
+                    merged = sampled.setdefault(stratum, [])
+                    for negative_key, item in heap:
+                        _keep(merged, size, -negative_key, item)
+            # 진행 상황 표시
+            if processed_lines >= next_report:
                 print(f"Processed {processed_lines} lines...")
+                next_report = (processed_lines // 100000 + 1) * 100000
+
+        if size is not None:
+            # N 모드만 끝까지 모아서 원본 순서대로 저장
+            saved_lines = write_lines(f_out, sorted(item for heap in sampled.values() for _, item in heap))
+    return processed_lines, saved_lines, unknown_lines
+
 
-    print(f"--- 작업 완료 ---")
+def write_lines(f_out, selected) -> int:
+    saved = 0
+    for _, line in selected:
+        f_out.write(line if line.endswith(b'\n') else line + b'\n')
+        saved += 1
+    return saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSONL 리뷰 파일에서 재현 가능한 샘플을 뽑습니다.")
+    parser.add_argument('input', nargs='?', default=original_file, help="원본 파일 (.jsonl, .jsonl.gz / .bz2 / .zst)")
+    parser.add_argument('output', nargs='?', default=new_file, help="저장할 파일")
+    parser.add_argument('--seed', type=int, default=sample_seed, help="난수 seed")
+    parser.add_argument('--ratio', type=float, default=sample_ratio, help="줄마다 뽑힐 확률 (-n 이 없을 때)")
+    parser.add_argument('-n', type=int, default=None, help="정확히 N 줄 (--stratify 와 함께면 층마다 N 줄)")
+    parser.add_argument('--stratify', type=str, default=None, metavar='FIELD',
+                        help="층으로 나눌 JSON 필드 (예: asin, parent_asin, rating, main_category)")
+    parser.add_argument('--no_index', action='store_true',
+                        help="<파일>.idx 인덱스가 있어도 쓰지 않고 파일 전체를 스캔")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help="병렬 스캔 프로세스 수 (압축 파일은 1)")
+    args = parser.parse_args()
+
+    if args.stratify and args.n is None:
+        parser.error("--stratify 는 -n 과 함께 써야 합니다")
+    if not os.path.exists(args.input):
+        print(f"오류: '{args.input}' 파일을 찾을 수 없습니다.")
+        sys.exit(1)
+
+    processed_lines, saved_lines, unknown_lines = sample_file(args.input, args.output, args.seed, args.ratio, args.n,
+                                                              args.stratify, args.processes,
+                                                              use_index=not args.no_index)
+    print("--- 작업 완료 ---")
     print(f"총 {processed_lines} 줄 중에서 {saved_lines} 줄을 저장했습니다.")
-    print(f"새 파일: {new_file}")
+    if unknown_lines:
+        print(f"'{args.stratify}' 필드가 없는 {unknown_lines} 줄은 제외했습니다.")
+    print(f"새 파일: {args.output}")
+
 
-except FileNotFoundError:
-    print(f"오류: '{original_file}' 파일을 찾을 수 없습니다.")
-except Exception as e:
-    print(f"오류 발생: {e}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import os
-# predictor.py는 실제 모델 로딩 및 예측 로직을 담당하는 파일입니다. (아래 별도 제공)
-# from predictor import ACOS_Predictor 
+import json
+import threading
+# predictor.py는 실제 모델 로딩 및 예측 로직을 담당하는 파일입니다.
+from predictor import ACOS_Predictor, TorchScriptPredictor
+from batcher import RequestBatcher
 
 # --- Flask 앱 설정 ---
 app = Flask(__name__)
@@ -13,16 +16,55 @@ CORS(app)
 STEP1_MODEL_DIR = './output/Extract-Classify-QUAD/rest16_1st/' 
 STEP2_MODEL_DIR = './output/Extract-Classify-QUAD/rest16_2nd/'
 
+# --- 결과 캐시 (정규화된 리뷰 텍스트 해시 -> 분석 결과, pipeline.py와 공유) ---
+RESULT_CACHE_DB = os.environ.get('ACOS_RESULT_CACHE_DB', './acos_cache.db')
+
+# --- int8 동적 양자화 추론 (CPU 전용, ACOS_QUANTIZE=1 로 활성화) ---
+QUANTIZE_INFERENCE = os.environ.get('ACOS_QUANTIZE', '0') == '1'
+
+# --- TorchScript 모델 (export_torchscript.py 결과 경로, 지정 시 modeling.py 없이 로딩) ---
+TORCHSCRIPT_MODEL_DIR = os.environ.get('ACOS_TORCHSCRIPT_DIR')
+
+# --- 마이크로 배칭 설정 ---
+# 동시에 들어온 /analyze 요청을 최대 BATCH_MAX_WAIT_MS 동안 모아 한 번의 forward로 처리합니다.
+BATCH_MAX_SIZE = int(os.environ.get('ACOS_BATCH_MAX_SIZE', 32))
+BATCH_MAX_WAIT_MS = float(os.environ.get('ACOS_BATCH_MAX_WAIT_MS', 5))
+
+# --- 대량 분석(/analyze_batch) 설정 ---
+ANALYZE_BATCH_SIZE = int(os.environ.get('ACOS_ANALYZE_BATCH_SIZE', 32))
+ANALYZE_BATCH_MAX_REVIEWS = int(os.environ.get('ACOS_ANALYZE_BATCH_MAX_REVIEWS', 10000))
+
 # --- 모델 로딩 (서버 시작 시 1회 실행) ---
+# serve.py로 실행하면 부모 프로세스에서 한 번만 로딩되고, fork된 워커들이 가중치를 공유합니다.
 predictor = None
-# try:
-#     if os.path.exists(STEP1_MODEL_DIR) and os.path.exists(STEP2_MODEL_DIR):
-#         # predictor = ACOS_Predictor(model_dir_step1=STEP1_MODEL_DIR, model_dir_step2=STEP2_MODEL_DIR)
-#         print("실제 모델 로더가 준비되었습니다. (현재 주석 처리됨)")
-#     else:
-#         print("경고: 훈련된 모델 경로를 찾을 수 없습니다. '/analyze' API는 가상 데이터로 응답합니다.")
-# except Exception as e:
-#     print(f"모델 로딩 중 오류 발생: {e}")
+try:
+    if TORCHSCRIPT_MODEL_DIR and os.path.exists(TORCHSCRIPT_MODEL_DIR):
+        predictor = TorchScriptPredictor(TORCHSCRIPT_MODEL_DIR, cache_path=RESULT_CACHE_DB)
+    elif os.path.exists(STEP1_MODEL_DIR) and os.path.exists(STEP2_MODEL_DIR):
+        predictor = ACOS_Predictor(model_dir_step1=STEP1_MODEL_DIR, model_dir_step2=STEP2_MODEL_DIR,
+                                   cache_path=RESULT_CACHE_DB, quantize=QUANTIZE_INFERENCE)
+    if predictor:
+        print("실제 모델 로더가 준비되었습니다.")
+    else:
+        print("경고: 훈련된 모델 경로를 찾을 수 없습니다. '/analyze' API는 가상 데이터로 응답합니다.")
+except Exception as e:
+    print(f"모델 로딩 중 오류 발생: {e}")
+
+# --- 마이크로 배처 (프로세스마다 하나) ---
+# 배치 스레드는 fork 후 자식 프로세스로 복제되지 않으므로, 각 프로세스의 첫 요청 시점에 생성합니다.
+_batcher = None
+_batcher_pid = None
+_batcher_lock = threading.Lock()
+
+def get_batcher():
+    global _batcher, _batcher_pid
+    if not predictor:
+        return None
+    with _batcher_lock:
+        if _batcher_pid != os.getpid():
+            _batcher = RequestBatcher(predictor.predict_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+            _batcher_pid = os.getpid()
+        return _batcher
 
 # --- API 엔드포인트: 실시간 문장 분석 ---
 @app.route('/analyze', methods=['POST'])
@@ -32,11 +74,12 @@ def analyze_sentence():
         return jsonify({'error': 'sentence가 누락되었습니다.'}), 400
 
     sentence = data['sentence']
-    
-    if predictor:
-        # 실제 모델을 사용하여 예측 수행
+    batcher = get_batcher()
+
+    if batcher:
+        # 실제 모델을 사용하여 예측 수행 (동시 요청과 함께 배치 처리)
         try:
-            results = predictor.predict(sentence)
+            results = batcher.predict(sentence)
             response = {
                 'input_sentence': sentence,
                 'results': results
@@ -57,5 +100,50 @@ def analyze_sentence():
         }
         return jsonify(example)
 
+# --- API 엔드포인트: 대량 리뷰 분석 (NDJSON 스트리밍) ---
+# 요청: {"reviews": [{"asin": "...", "text": "..."}, ...]} 또는 {"sentences": ["...", ...]}
+# 응답: 리뷰 하나당 한 줄의 JSON. 길이순 배치로 처리되므로 완료된 순서대로 전송됩니다.
+@app.route('/analyze_batch', methods=['POST'])
+def analyze_batch():
+    data = request.get_json()
+    if not data or not ('reviews' in data or 'sentences' in data):
+        return jsonify({'error': 'reviews 또는 sentences가 누락되었습니다.'}), 400
+
+    reviews = data.get('reviews')
+    if reviews is None:
+        reviews = [{'text': sentence} for sentence in data['sentences']]
+    if not isinstance(reviews, list):
+        return jsonify({'error': 'reviews는 리스트여야 합니다.'}), 400
+    if len(reviews) > ANALYZE_BATCH_MAX_REVIEWS:
+        return jsonify({'error': f'한 번에 최대 {ANALYZE_BATCH_MAX_REVIEWS}개까지 분석할 수 있습니다.'}), 413
+
+    asins = []
+    sentences = []
+    for review in reviews:
+        if isinstance(review, str):
+            review = {'text': review}
+        text = review.get('text', review.get('sentence')) if isinstance(review, dict) else None
+        if not isinstance(text, str):
+            return jsonify({'error': '각 리뷰에는 text(또는 sentence)가 필요합니다.'}), 400
+        asins.append(review.get('asin'))
+        sentences.append(text)
+
+    if not predictor:
+        return jsonify({'error': '모델이 로드되지 않았습니다.'}), 503
+
+    def generate():
+        try:
+            for index, results in predictor.predict_stream(sentences, batch_size=ANALYZE_BATCH_SIZE):
+                line = {'index': index, 'input_sentence': sentences[index], 'results': results}
+                if asins[index] is not None:
+                    line['asin'] = asins[index]
+                yield json.dumps(line, ensure_ascii=False) + '\n'
+        except Exception as e:
+            print(f"대량 예측 중 오류 발생: {e}")
+            yield json.dumps({'error': '문장 분석 중 오류가 발생했습니다.'}, ensure_ascii=False) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 if __name__ == '__main__':
+    # 개발용 단일 프로세스 서버입니다. 운영 환경에서는 serve.py (pre-fork 멀티 워커)를 사용하세요.
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
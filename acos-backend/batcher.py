@@ -0,0 +1,65 @@
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class RequestBatcher:
+    """
+    Coalesces concurrent single-sentence requests into one batched forward pass.
+
+    Callers `submit` a sentence and get a Future. A background thread waits for the
+    first pending request, keeps collecting for up to `max_wait_ms` (or until
+    `max_batch_size` requests are queued), runs `predict_batch_fn` once on the whole
+    batch and resolves every caller's Future with its own result.
+    """
+
+    def __init__(self, predict_batch_fn: Callable[[List[str]], List[Any]],
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size should be >= 1, got {}".format(max_batch_size))
+        self.predict_batch_fn = predict_batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='acos-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, sentence: str) -> Future:
+        future = Future()
+        self._queue.put((sentence, future))
+        return future
+
+    def predict(self, sentence: str, timeout: float = None):
+        return self.submit(sentence).result(timeout=timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            sentences = [sentence for sentence, _ in batch]
+            try:
+                results = self.predict_batch_fn(sentences)
+            except Exception as e:
+                logger.error(f"Batched prediction failed for {len(batch)} requests: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,316 @@
+import os
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import logging
+import platform
+import resource
+import tempfile
+import multiprocessing
+from typing import List, Dict, Any
+
+from stage_metrics import peak_rss_mb
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# ACOS SENTENCES USED AS SYNTHETIC REVIEW MATERIAL (first column of data/*/DOMAIN_quad_*.tsv)
+ACOS_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ACOS-main', 'data')
+DOMAIN_DATA_DIRS = {
+    'rest16': os.path.join(ACOS_DATA_DIR, 'Restaurant-ACOS'),
+    'laptop': os.path.join(ACOS_DATA_DIR, 'Laptop-ACOS'),
+}
+
+# SENTENCES PER REVIEW DISTRIBUTIONS
+LENGTH_DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal')
+
+# Undo the word tokenization of the ACOS data, so the tokenizer sees Amazon-like raw text
+DETOKENIZE = ((" ' ", "'"), (' ,', ','), (' .', '.'), (' !', '!'), (' ?', '?'), (' ;', ';'), (' :', ':'),
+              (" n't", "n't"), (" 's", "'s"), (" 're", "'re"), (" 've", "'ve"), (" 'm", "'m"), (" 'll", "'ll"),
+              ('( ', '('), (' )', ')'), ('$ ', '$'))
+
+
+# --- Synthetic reviews ---
+def load_seed_sentences(domains: List[str]) -> List[str]:
+    sentences = []
+    for domain in domains:
+        data_dir = DOMAIN_DATA_DIRS[domain]
+        for name in sorted(os.listdir(data_dir)):
+            if not name.endswith('.tsv'):
+                continue
+            with open(os.path.join(data_dir, name), 'r', encoding='utf-8') as f:
+                for line in f:
+                    text = line.split('\t', 1)[0].strip()
+                    if not text:
+                        continue
+                    for old, new in DETOKENIZE:
+                        text = text.replace(old, new)
+                    sentences.append(text[0].upper() + text[1:])
+    return sentences
+
+
+def sample_length(rng: random.Random, distribution: str, mean_sentences: float, max_sentences: int) -> int:
+    if distribution == 'fixed':
+        length = round(mean_sentences)
+    elif distribution == 'uniform':
+        length = rng.randint(1, max(1, round(2 * mean_sentences - 1)))
+    else:
+        # long-tailed like real review dumps: mostly short reviews, a few paragraphs
+        length = round(rng.lognormvariate(0, 0.9) * mean_sentences / 1.5)
+    return min(max(length, 1), max_sentences)
+
+
+def generate_reviews(path: str, num_reviews: int, sentences: List[str], distribution: str = 'lognormal',
+                     mean_sentences: float = 3.0, max_sentences: int = 30, num_products: int = 500,
+                     seed: int = 13) -> Dict[str, Any]:
+    """
+    Writes num_reviews Amazon-style JSONL reviews (same fields as the Amazon Reviews'23 dumps) built
+    from random seed sentences. Products are Zipf-distributed like real dumps: few asins get most reviews.
+    """
+    rng = random.Random(seed)
+    asins = ['B{:09d}'.format(rng.randrange(10 ** 9)) for _ in range(num_products)]
+    weights = [1.0 / (rank + 1) for rank in range(num_products)]
+    total_sentences = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(num_reviews):
+            length = sample_length(rng, distribution, mean_sentences, max_sentences)
+            text = ' '.join(rng.choice(sentences) for _ in range(length))
+            total_sentences += length
+            asin = rng.choices(asins, weights)[0]
+            review = {
+                'rating': float(rng.randint(1, 5)),
+                'title': ' '.join(text.split()[:rng.randint(2, 6)]),
+                'text': text,
+                'images': [],
+                'asin': asin,
+                'parent_asin': asin,
+                'user_id': 'U{:012d}'.format(rng.randrange(10 ** 12)),
+                'timestamp': 1500000000000 + rng.randrange(2 * 10 ** 11),
+                'helpful_vote': rng.randint(0, 5),
+                'verified_purchase': rng.random() < 0.9,
+            }
+            f.write(json.dumps(review) + '\n')
+    return {'reviews': num_reviews, 'sentences': total_sentences, 'bytes': os.path.getsize(path)}
+
+
+# --- Measurements ---
+def percentile(values: List[float], q: float):
+    if not values:
+        return None
+    # nearest rank
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100.0 * len(values)) - 1)]
+
+
+def install_probes(batches: List[Dict[str, Any]], loads: List[float]):
+    """
+    Times model loading and every extract_pairs -> classify_pairs batch of the ACOS_Predictor
+    instances created in this process.
+    """
+    from predictor import ACOS_Predictor
+    init, extract_pairs, classify_pairs = ACOS_Predictor.__init__, ACOS_Predictor.extract_pairs, ACOS_Predictor.classify_pairs
+
+    def timed_init(self, *args, **kwargs):
+        start = time.perf_counter()
+        init(self, *args, **kwargs)
+        loads.append(time.perf_counter() - start)
+
+    def timed_extract_pairs(self, encoded):
+        start = time.perf_counter()
+        pairs = extract_pairs(self, encoded)
+        batches.append({'sentences': len(encoded), 'pairs': len(pairs), 'seconds': time.perf_counter() - start})
+        return pairs
+
+    def timed_classify_pairs(self, encoded, pairs):
+        start = time.perf_counter()
+        results = classify_pairs(self, encoded, pairs)
+        batches[-1]['seconds'] += time.perf_counter() - start
+        return results
+
+    ACOS_Predictor.__init__ = timed_init
+    ACOS_Predictor.extract_pairs = timed_extract_pairs
+    ACOS_Predictor.classify_pairs = timed_classify_pairs
+
+
+def summarize(reviews: int, seconds: float, batches: List[Dict[str, Any]], loads: List[float]) -> Dict[str, Any]:
+    # rates exclude model loading, which does not grow with the input
+    load_seconds = sum(loads)
+    total_seconds = seconds
+    seconds = max(total_seconds - load_seconds, 0.0)
+    pairs = sum(batch['pairs'] for batch in batches)
+    latencies = [batch['seconds'] for batch in batches]
+    return {
+        'reviews': reviews,
+        'total_seconds': total_seconds,
+        'model_load_seconds': load_seconds,
+        'seconds': seconds,
+        'reviews_per_sec': reviews / seconds if seconds > 0 else 0.0,
+        'batches': len(batches),
+        'pairs': pairs,
+        'pairs_per_sec': pairs / seconds if seconds > 0 else 0.0,
+        'batch_latency_p50': percentile(latencies, 50),
+        'batch_latency_p99': percentile(latencies, 99),
+    }
+
+
+# --- Runs (each in a fresh spawned process, so peak RSS is per run) ---
+def pipeline_run(review_file: str, work_dir: str, settings: Dict[str, Any], num_workers: int, result_queue):
+    try:
+        import pipeline
+        pipeline.NEW_REVIEW_FILE = review_file
+        pipeline.FLASK_DB_PATH = os.path.join(work_dir, 'bench.db')
+        pipeline.RESULT_CACHE_DB = os.path.join(work_dir, 'bench_cache.db')
+        pipeline.RESULT_RECORDS_FILE = None
+        pipeline.RUN_REPORT = True
+        for name, value in settings.items():
+            setattr(pipeline, name, value)
+
+        # main_pipeline hands these settings to shard and stage workers through run_config()
+        batches, loads = [], []
+        install_probes(batches, loads)
+        start = time.perf_counter()
+        pipeline.main_pipeline(num_workers=num_workers)
+        seconds = time.perf_counter() - start
+
+        with open(review_file, 'rb') as f:
+            reviews = sum(1 for line in f if line.strip())
+        stages = load_run_stages(work_dir)
+        if not batches and 'model_load' in stages:
+            # inference ran in worker processes, where the probes are not installed: model loading and
+            # pair counts come from the stage metrics of the run report; batch latency is not observed.
+            # Workers load concurrently, so one average load is taken off the wall time.
+            loads = [stages['model_load']['wall_seconds'] / max(stages['model_load']['calls'], 1)]
+        report = summarize(reviews, seconds, batches, loads)
+        if not batches and 'pair_generation' in stages:
+            report['pairs'] = stages['pair_generation']['items_out']
+            report['pairs_per_sec'] = report['pairs'] / report['seconds'] if report['seconds'] > 0 else 0.0
+        report['stages'] = stages
+        conn = pipeline.open_results_db(pipeline.FLASK_DB_PATH)
+        report['quads'] = conn.execute("SELECT COUNT(*) FROM acos_results").fetchone()[0]
+        conn.close()
+        report['quads_per_sec'] = report['quads'] / report['seconds'] if report['seconds'] > 0 else 0.0
+        # children: largest worker process that has exited, as in the pipeline run report
+        report['peak_rss_mb'] = {'self': peak_rss_mb(), 'children': peak_rss_mb(resource.RUSAGE_CHILDREN)}
+        result_queue.put(('ok', report))
+    except BaseException as e:
+        result_queue.put(('error', repr(e)))
+
+
+def load_run_stages(work_dir: str) -> Dict[str, Any]:
+    # stage metrics of the run report main_pipeline wrote next to bench.db (see pipeline.RUN_REPORT)
+    reports = sorted(name for name in os.listdir(work_dir) if name.startswith('bench_run_') and name.endswith('.json'))
+    if not reports:
+        return {}
+    with open(os.path.join(work_dir, reports[-1]), 'r', encoding='utf-8') as f:
+        return json.load(f).get('stages', {})
+
+
+def predictor_run(review_file: str, predictor_kwargs: Dict[str, Any], batch_size: int, result_queue):
+    try:
+        from predictor import ACOS_Predictor
+        with open(review_file, 'r', encoding='utf-8') as f:
+            texts = [json.loads(line)['text'] for line in f if line.strip()]
+        batches, loads = [], []
+        install_probes(batches, loads)
+        predictor = ACOS_Predictor(**predictor_kwargs)
+        start = time.perf_counter()
+        for _ in predictor.predict_stream(texts, batch_size=batch_size):
+            pass
+        seconds = time.perf_counter() - start
+        report = summarize(len(texts), seconds, batches, [])
+        report['model_load_seconds'] = sum(loads)
+        # children: largest worker process that has exited, as in the pipeline run report
+        report['peak_rss_mb'] = {'self': peak_rss_mb(), 'children': peak_rss_mb(resource.RUSAGE_CHILDREN)}
+        result_queue.put(('ok', report))
+    except BaseException as e:
+        result_queue.put(('error', repr(e)))
+
+
+def run_isolated(target, args) -> Dict[str, Any]:
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=target, args=args + (result_queue,))
+    process.start()
+    kind, payload = result_queue.get()
+    process.join()
+    if kind == 'error':
+        raise RuntimeError(payload)
+    return payload
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="End-to-end ACOS throughput benchmark on synthetic Amazon-style reviews (JSON report).")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000],
+                        help="Number of reviews of each generated input.")
+    parser.add_argument('--domains', type=str, nargs='+', default=['rest16', 'laptop'], choices=sorted(DOMAIN_DATA_DIRS),
+                        help="ACOS datasets the review sentences are drawn from.")
+    parser.add_argument('--length_dist', type=str, default='lognormal', choices=LENGTH_DISTRIBUTIONS)
+    parser.add_argument('--mean_sentences', type=float, default=3.0)
+    parser.add_argument('--max_sentences', type=int, default=30)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=13)
+    parser.add_argument('--modes', type=str, nargs='+', default=['pipeline'], choices=['pipeline', 'predictor'],
+                        help="pipeline: main_pipeline with DB writes; predictor: ACOS_Predictor.predict_stream only.")
+    parser.add_argument('--workers', type=int, default=1, help="PIPELINE_WORKERS of the pipeline runs.")
+    parser.add_argument('--stage_parallel', action='store_true', help="Run the pipeline with STAGE_PARALLEL.")
+    parser.add_argument('--batch_size', type=int, default=32, help="Batch size of the predictor runs.")
+    parser.add_argument('--quantize', action='store_true')
+    parser.add_argument('--model_dir_step1', type=str, default='./Trained/rest16_1st')
+    parser.add_argument('--model_dir_step2', type=str, default='./Trained/rest16_2nd')
+    parser.add_argument('--work_dir', type=str, default=None,
+                        help="Where inputs and DBs are written (default: a temporary directory, removed afterwards).")
+    parser.add_argument('--generate_only', action='store_true', help="Only write the synthetic JSONL inputs.")
+    parser.add_argument('--output', type=str, default='./benchmark_report.json')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='acos-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    sentences = load_seed_sentences(args.domains)
+    logging.info(f"{len(sentences)} seed sentences from {args.domains}")
+
+    report = {
+        'config': vars(args),
+        'host': {'platform': platform.platform(), 'python': platform.python_version(), 'cpu_count': os.cpu_count()},
+        'runs': [],
+    }
+    try:
+        for scale in args.scales:
+            review_file = os.path.join(work_dir, f'synthetic_{scale}.jsonl')
+            data = generate_reviews(review_file, scale, sentences, args.length_dist, args.mean_sentences,
+                                    args.max_sentences, args.products, args.seed)
+            logging.info(f"Generated '{review_file}': {data}")
+            if args.generate_only:
+                report['runs'].append(dict(data, input=review_file))
+                continue
+
+            for mode in args.modes:
+                run_dir = os.path.join(work_dir, f'{mode}_{scale}')
+                shutil.rmtree(run_dir, ignore_errors=True)
+                os.makedirs(run_dir)
+                if mode == 'pipeline':
+                    settings = {'TRAINED_MODEL_STEP1': args.model_dir_step1, 'TRAINED_MODEL_STEP2': args.model_dir_step2,
+                                'QUANTIZE_INFERENCE': args.quantize, 'STAGE_PARALLEL': args.stage_parallel}
+                    result = run_isolated(pipeline_run, (review_file, run_dir, settings, args.workers))
+                else:
+                    predictor_kwargs = {'model_dir_step1': args.model_dir_step1,
+                                        'model_dir_step2': args.model_dir_step2, 'quantize': args.quantize,
+                                        'segment_sentences': False}
+                    result = run_isolated(predictor_run, (review_file, predictor_kwargs, args.batch_size))
+                result.update(mode=mode, scale=scale, input_sentences=data['sentences'], input_bytes=data['bytes'])
+                report['runs'].append(result)
+                logging.info(f"[{mode} x {scale}] {result['reviews_per_sec']:.1f} reviews/s, "
+                             f"{result['pairs_per_sec']:.1f} pairs/s, peak RSS {result['peak_rss_mb']['self']:.0f} MB")
+    finally:
+        if not args.work_dir and not args.generate_only:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Report saved to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
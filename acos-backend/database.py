@@ -1,8 +1,6 @@
 import sqlite3
-import torch
 import os
-from bert_utils.tokenization import BertTokenizer
-from modeling import BertForQuadABSA, CategorySentiClassification
+from predictor import ACOS_Predictor
 from tqdm import tqdm
 
 # --- Configuration ---
@@ -37,31 +35,14 @@ DUMMY_REVIEWS = {
 class ACOS_Processor:
     def __init__(self, model_dir_step1, model_dir_step2):
         print("Initializing ACOS Processor...")
-        self.device = torch.device("cpu")
-        self.tokenizer = BertTokenizer.from_pretrained(model_dir_step1, do_lower_case=True)
-        self.model_step1 = BertForQuadABSA.from_pretrained(model_dir_step1)
-        self.model_step1.to(self.device)
-        self.model_step1.eval()
-        self.model_step2 = CategorySentiClassification.from_pretrained(model_dir_step2)
-        self.model_step2.to(self.device)
-        self.model_step2.eval()
+        self.predictor = ACOS_Predictor(model_dir_step1, model_dir_step2)
         print("Models loaded successfully.")
 
     def analyze(self, sentence):
-        # TODO: The actual ACOS model analysis logic needs to be implemented here.
-        #       Step 1 -> Extract Aspect-Opinion pairs
-        #       Step 2 -> Classify Category-Sentiment
-        # For now, it returns dummy analysis results.
+        # Step 1 -> Extract Aspect-Opinion pairs
+        # Step 2 -> Classify Category-Sentiment
         print(f"Analyzing: \"{sentence}\"")
-        if "soft" in sentence:
-            return [{"aspect": "texture", "category": "TEXTURE", "opinion": "soft", "sentiment": "Positive"}]
-        if "hard" in sentence:
-            return [{"aspect": "texture", "category": "TEXTURE", "opinion": "hard", "sentiment": "Negative"}]
-        if "screen" in sentence or "design" in sentence:
-            return [{"aspect": "screen", "category": "DESIGN", "opinion": "beautiful", "sentiment": "Positive"}]
-        if "battery" in sentence:
-            return [{"aspect": "battery life", "category": "BATTERY", "opinion": "short", "sentiment": "Negative"}]
-        return []
+        return self.predictor.predict(sentence)
 
 def setup_database():
     # If the DB file already exists, delete it and start over.
@@ -133,11 +114,7 @@ def process_and_store_data(conn, cursor, processor):
 
 if __name__ == '__main__':
     # Load ACOS model processor
-    # Note: A DummyProcessor can be used for testing until the actual analysis logic is implemented.
-    # processor = ACOS_Processor(STEP1_MODEL_DIR, STEP2_MODEL_DIR) # For loading the actual model
-    class DummyProcessor: # Dummy processor for testing
-        def analyze(self, s): return ACOS_Processor.analyze(self, s)
-    processor = DummyProcessor()
+    processor = ACOS_Processor(STEP1_MODEL_DIR, STEP2_MODEL_DIR)
 
     # Set up DB and run data processing
     conn, cursor = setup_database()
@@ -0,0 +1,100 @@
+import os
+import json
+import argparse
+import logging
+
+import torch
+from torch import nn
+
+from predictor import ACOS_Predictor, TORCHSCRIPT_STEP1, TORCHSCRIPT_STEP2, TORCHSCRIPT_META
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class Step1Graph(nn.Module):
+    """Inference path of BertForQuadABSA: encoder, CRF emission head and implicit aspect/opinion heads."""
+
+    def __init__(self, model):
+        super(Step1Graph, self).__init__()
+        self.model = model
+
+    def forward(self, input_ids, token_type_ids, attention_mask):
+        return self.model._emissions(input_ids, token_type_ids, attention_mask)
+
+
+class Step2Graph(nn.Module):
+    """Encode-once inference path of CategorySentiClassification (see classify_shared).
+    Inputs are already trimmed to the batch's longest sentence by the predictor."""
+
+    def __init__(self, model):
+        super(Step2Graph, self).__init__()
+        self.model = model
+
+    def forward(self, input_ids, token_type_ids, attention_mask, pair_index, candidate_aspect, candidate_opinion):
+        pooled_outputs, _ = self.model.bert(input_ids, token_type_ids, attention_mask,
+                                            output_all_encoded_layers=False, head_mask=None)
+        return self.model._pair_logits(pooled_outputs[pair_index], candidate_aspect, candidate_opinion)
+
+
+def _example_inputs(seq_len: int = 16):
+    input_ids = torch.randint(1000, 2000, (2, seq_len), dtype=torch.long)
+    attention_mask = torch.ones((2, seq_len), dtype=torch.long)
+    attention_mask[1, seq_len // 2:] = 0
+    return input_ids, torch.zeros_like(input_ids), attention_mask
+
+
+def export(predictor: ACOS_Predictor, output_dir: str, meta: dict):
+    os.makedirs(output_dir, exist_ok=True)
+    input_ids, token_type_ids, attention_mask = _example_inputs()
+
+    with torch.no_grad():
+        step1 = torch.jit.trace(Step1Graph(predictor.model_step1).eval(),
+                                (input_ids, token_type_ids, attention_mask))
+        pair_index = torch.tensor([0, 0, 1], dtype=torch.long)
+        candidate_aspect = torch.zeros((3, input_ids.size(1)), dtype=torch.long)
+        candidate_opinion = torch.zeros((3, input_ids.size(1)), dtype=torch.long)
+        candidate_aspect[:, 1] = 1
+        candidate_opinion[:, 2:4] = 1
+        step2 = torch.jit.trace(Step2Graph(predictor.model_step2).eval(),
+                                (input_ids, token_type_ids, attention_mask,
+                                 pair_index, candidate_aspect, candidate_opinion))
+
+    step1 = torch.jit.freeze(step1)
+    step2 = torch.jit.freeze(step2)
+    torch.jit.save(step1, os.path.join(output_dir, TORCHSCRIPT_STEP1),
+                   _extra_files={TORCHSCRIPT_META: json.dumps(meta)})
+    torch.jit.save(step2, os.path.join(output_dir, TORCHSCRIPT_STEP2))
+    predictor.tokenizer.save_vocabulary(output_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export frozen TorchScript graphs of both ACOS models.")
+    parser.add_argument('--model_dir_step1', type=str, default='./Trained/rest16_1st')
+    parser.add_argument('--model_dir_step2', type=str, default='./Trained/rest16_2nd')
+    parser.add_argument('--domain_type', type=str, default='rest16')
+    parser.add_argument('--max_seq_length', type=int, default=128)
+    parser.add_argument('--quantize', action='store_true',
+                        help="Export the int8 dynamic quantized models (CPU only).")
+    parser.add_argument('--output_dir', type=str, default='./Trained/rest16_torchscript')
+    args = parser.parse_args()
+
+    predictor = ACOS_Predictor(args.model_dir_step1, args.model_dir_step2, domain_type=args.domain_type,
+                               max_seq_length=args.max_seq_length, quantize=args.quantize)
+    crf = predictor.model_step1.crf
+    meta = {
+        'domain_type': args.domain_type,
+        'max_seq_length': args.max_seq_length,
+        'quantized': args.quantize,
+        'fingerprint': predictor.fingerprint,
+        'seq_labels': sorted(predictor.label_map_seq, key=predictor.label_map_seq.get),
+        'catesenti_labels': [predictor.catesenti_dict[i] for i in range(len(predictor.catesenti_dict))],
+        'crf_start_transitions': crf.start_transitions.detach().cpu().tolist(),
+        'crf_end_transitions': crf.end_transitions.detach().cpu().tolist(),
+        'crf_transitions': crf.transitions.detach().cpu().tolist(),
+    }
+    export(predictor, args.output_dir, meta)
+    logging.info(f"TorchScript models saved to '{args.output_dir}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,33 @@
 import sys
 import os
-import importlib
-# ACOS CODE IMPORT
-ACOS_CODE_DIR = os.path.abspath('./ACOS-main/Extract-Classify-ACOS')
-sys.path.insert(0, ACOS_CODE_DIR)
-import run_classifier_dataset_utils
-importlib.reload(run_classifier_dataset_utils)
-print("="*50)
-print("DEBUG: Loaded 'run_classifier_dataset_utils' from:")
-print(run_classifier_dataset_utils.__file__)
-print("="*50)
-
-import pandas as pd
 import sqlite3
-import argparse
 import json
-import shutil
+import time
+import queue
+import hashlib
 import logging
+import threading
+import resource
+import traceback
+from datetime import datetime
 from typing import List, Dict, Any
 
+import torch
 
-# Helper function to build argv from argparse.Namespace
-def build_argv_from_args(args_namespace, script_name="script.py"):
-    argv = [script_name]
-    for key, value in vars(args_namespace).items():
-        if isinstance(value, bool):
-            if value:
-                argv.append(f'--{key}')
-        elif value is not None:
-            argv.append(f'--{key}')
-            argv.append(str(value))
-    return argv
-
-
-try:
-    import run_step1
-    import run_step2
-    from tokenized_data import get_1st_pairs
-except ImportError as e:
-    print(f"Error: Cannot import ACOS Code. ACOS_CODE_DIR: {ACOS_CODE_DIR}")
-    print(f"Error details: {e}")
-    sys.exit(1)
+from predictor import ACOS_Predictor, SEGMENTED_SCOPE
+from stage_pool import StagePools
+from result_cache import ResultCache, model_fingerprint, normalize_text, text_hash, remap_spans
+from review_reader import iter_reviews, input_size, is_compressed, parse_review, spawn_context, JSON_BACKEND
+from review_index import open_index, build_index, read_records
+from results_db import (open_results_db, filter_analyzed, journal_pending_ranges, next_chunk_id, commit_chunk,
+                        write_records, delete_products)
+from stage_metrics import StageMetrics, measure, peak_rss_mb
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# BERT MODEL
-BERT_BASE_DIR = './ACOS-main/Extract-Classify-ACOS/bert-base-uncased'
-
 # AMAZON REVIEW DATASET PATH
+# .jsonl, or a compressed .jsonl.gz / .jsonl.bz2 / .jsonl.zst read as a stream (byte offsets in the
+# journal are then positions in the decompressed stream; sharding is not available)
 NEW_REVIEW_FILE = './Data/Appliances_trimmed.jsonl'
 
 # SQLLITE DB PATH
@@ -57,279 +37,723 @@ FLASK_DB_PATH = './db1.db'
 TRAINED_MODEL_STEP1 = './Trained/rest16_1st'
 TRAINED_MODEL_STEP2 = './Trained/rest16_2nd'
 
-# TEMP PATH
-TEMP_DATA_DIR = '/tmp/acos_pipeline'
+# DOMAIN OF THE TRAINED MODELS (category-sentiment label set)
+DOMAIN_TYPE = 'rest16'
+MAX_SEQ_LENGTH = 128
+
+# SENTENCE SEGMENTATION: reviews are analyzed sentence by sentence (sentences longer than MAX_SEQ_LENGTH
+# wordpieces in windows), and the quads of all sentences are merged with review-level character spans.
+# Off: each review is one sequence truncated at MAX_SEQ_LENGTH.
+SPLIT_SENTENCES = True
+
+# INFERENCE BATCH SIZE (sentences per STEP1 forward, sorted by length)
+PREDICT_BATCH_SIZE = 32
+
+# INT8 DYNAMIC QUANTIZED INFERENCE (CPU ONLY)
+QUANTIZE_INFERENCE = False
+
+# RESULT CACHE PATH (shared with app.py predictor)
+RESULT_CACHE_DB = './acos_cache.db'
+
+# PARALLEL JSONL DECODING: processes that parse newline-aligned blocks of READER_BLOCK_BYTES of the input
+# and send back only asin and text (0: parse in the reader thread). orjson is used when installed.
+READER_PROCESSES = 0
+READER_BLOCK_BYTES = 8 * 2 ** 20
+
+# STREAMING CHUNK SIZE (reviews read, analyzed and committed to DB together)
+# Peak memory depends on this, not on the size of NEW_REVIEW_FILE.
+CHUNK_SIZE = 2000
+
+# RESUME FROM THE PROGRESS JOURNAL (pipeline_journal table in FLASK_DB_PATH)
+# A rerun starts after the last committed chunk of the same file instead of from the beginning.
+RESUME_FROM_JOURNAL = True
+
+# Bytes at the start of a file that identify it in the journal (a replaced file restarts at 0)
+SOURCE_HEAD_BYTES = 4096
+
+# SHARDED EXECUTION: worker processes, each with its own CPU model over a byte range of the input.
+# 1 runs everything in this process. Results go through a single DB writer (this process).
+PIPELINE_WORKERS = 1
+# torch threads per worker (None: cpu_count // PIPELINE_WORKERS)
+PIPELINE_WORKER_THREADS = None
+
+# STAGE-PARALLEL EXECUTION: separate step-1 and step-2 worker process pools (STAGE_WORKERS in total),
+# resized every STAGE_REBALANCE_SECONDS to their measured per-sentence cost. Takes precedence over PIPELINE_WORKERS.
+STAGE_PARALLEL = False
+STAGE_WORKERS = 4
+STEP1_BATCH_SIZE = 32   # sentences per step-1 forward
+STEP2_BATCH_SIZE = 64   # candidate pairs per step-2 forward
+STAGE_REBALANCE_SECONDS = 30
+
+# QUAD RECORD STREAM (None: DB only)
+# Every committed review is also appended here as line-delimited records (see results_db.RECORD_FIELDS):
+# asin, review text, aspect/opinion with their character spans, category, sentiment and score.
+# Load them into another DB with: python results_db.py <file> --db <db>
+RESULT_RECORDS_FILE = None
+
+# RUN REPORT: per-stage wall/CPU time, item and token counters and memory of every run,
+# written as FLASK_DB_PATH's name + '_run_<timestamp>.json' next to the DB
+RUN_REPORT = True
+
+# OVERLAPPED STAGES: chunks read + tokenized ahead of inference, and analyzed chunks waiting for the DB writer
+PREFETCH_CHUNKS = 2
+WRITE_QUEUE_CHUNKS = 2
+
+
+# JSONL TO REVIEW CHUNKS
+# Streams (reviews, start_offset, end_offset) with at most chunk_size (product_id, text) reviews;
+# the file is never loaded whole. Offsets are byte positions, so a chunk can be resumed with a seek.
+def iter_review_chunks(source_jsonl_path: str, chunk_size: int = CHUNK_SIZE, stats: Dict[str, int] = None,
+                       start_offset: int = 0, end_offset: int = None, reader_processes: int = 0,
+                       reader_block_bytes: int = READER_BLOCK_BYTES):
+    if end_offset is None:
+        end_offset = input_size(source_jsonl_path)
+
+    chunk = []
+    chunk_start = offset = start_offset
+    for product_id, text, offset in iter_reviews(source_jsonl_path, start_offset, end_offset, stats,
+                                                 reader_processes, reader_block_bytes):
+        # a full chunk is held until the next review, so the last one can still be extended below
+        if len(chunk) >= chunk_size:
+            yield chunk, chunk_start, chunk_end
+            chunk = []
+            chunk_start = chunk_end
+        chunk.append((product_id, text))
+        chunk_end = offset
+
+    if chunk:
+        # the last chunk also covers blank and unusable lines up to the end of the range,
+        # so the whole range is journaled
+        yield chunk, chunk_start, chunk_end if end_offset is None else max(chunk_end, end_offset)
+    elif end_offset is not None and end_offset > start_offset:
+        # a range of blank or unusable lines only: an empty chunk journals it as done
+        yield chunk, start_offset, end_offset
+
+
+# SPLIT A CHUNK INTO CACHED / NEW REVIEWS (one bulk cache lookup per chunk)
+def split_cached(reviews, cache: ResultCache = None):
+    if not cache:
+        return list(reviews), []
+    new_reviews = []
+    cached_reviews = []
+    for (product_id, text), quads in zip(reviews, cache.get_many([text for _, text in reviews])):
+        if quads is not None:
+            cached_reviews.append((product_id, text, quads))
+        else:
+            new_reviews.append((product_id, text))
+    return new_reviews, cached_reviews
+
+
+# LOAD BOTH TRAINED MODELS
+def predictor_kwargs(device=None) -> Dict[str, Any]:
+    if device is None:
+        device = torch.device("cuda" if torch.cuda.is_available() and not QUANTIZE_INFERENCE else "cpu")
+    return {'model_dir_step1': TRAINED_MODEL_STEP1, 'model_dir_step2': TRAINED_MODEL_STEP2, 'domain_type': DOMAIN_TYPE,
+            'max_seq_length': MAX_SEQ_LENGTH, 'device': device, 'quantize': QUANTIZE_INFERENCE,
+            'segment_sentences': SPLIT_SENTENCES}
+
+
+# RESULT CACHE SCOPE (same as the predictor's, see ACOS_Predictor._init_cache)
+def cache_fingerprint() -> str:
+    fingerprint = model_fingerprint(TRAINED_MODEL_STEP1, TRAINED_MODEL_STEP2, variant='int8' if QUANTIZE_INFERENCE else '')
+    return fingerprint + (SEGMENTED_SCOPE if SPLIT_SENTENCES else '')
+
+
+# RUN SETTINGS, read once in the parent and passed to every stage and worker process.
+# Spawned shard workers re-import this module, so they would otherwise see the defaults
+# above instead of values set at runtime (by benchmark.py, for one).
+def run_config(device=None) -> Dict[str, Any]:
+    return {
+        'source': NEW_REVIEW_FILE, 'db_path': FLASK_DB_PATH, 'records_file': RESULT_RECORDS_FILE,
+        'cache_db': RESULT_CACHE_DB, 'cache_fingerprint': cache_fingerprint(),
+        'predictor_kwargs': predictor_kwargs(device), 'batch_size': PREDICT_BATCH_SIZE,
+        'chunk_size': CHUNK_SIZE, 'prefetch_chunks': PREFETCH_CHUNKS,
+        'reader_processes': READER_PROCESSES, 'reader_block_bytes': READER_BLOCK_BYTES,
+    }
+
+
+def load_predictor(kwargs: Dict[str, Any] = None, stages=(1, 2), metrics: StageMetrics = None) -> ACOS_Predictor:
+    kwargs = predictor_kwargs() if kwargs is None else kwargs
+    logging.info("Loading ACOS models...")
+    try:
+        with measure(metrics, 'model_load'):
+            predictor = ACOS_Predictor(stages=stages, **kwargs)
+        predictor.metrics = metrics
+        return predictor
+    except Exception as e:
+        logging.error(f"Error while loading ACOS models: {e}")
+        logging.error(f"   >Check TRAINED_MODEL_STEP1: {kwargs['model_dir_step1']} and "
+                      f"TRAINED_MODEL_STEP2: {kwargs['model_dir_step2']}")
+        sys.exit(1)
 
-# TEMP STEP1 INPUT PATH
-STEP1_INPUT_DIR = os.path.join(TEMP_DATA_DIR, 'step1_input')
 
-# TEMP STEP1 OUTPUT PATH
-STEP1_OUTPUT_DIR = os.path.join(TEMP_DATA_DIR, 'step1_output')
+# Models are loaded on the first call, i.e. on the first chunk that is not fully cached
+def lazy_predictor(kwargs: Dict[str, Any], stages=(1, 2), metrics: StageMetrics = None):
+    holder = {}
 
-# TEMP STEP2 INPUT PATH
-STEP2_INPUT_DIR = os.path.join(TEMP_DATA_DIR, 'step2_input')
+    def get_predictor() -> ACOS_Predictor:
+        if 'predictor' not in holder:
+            holder['predictor'] = load_predictor(kwargs, stages, metrics)
+        return holder['predictor']
+    return get_predictor
 
-# TEMP STEP2 OUTPUT PATH
-STEP2_OUTPUT_DIR = os.path.join(TEMP_DATA_DIR, 'step2_output')
 
-DOMAIN_NAME = 'predict'
-STEP1_INPUT_FILE_TSV = f"{DOMAIN_NAME}_quad_bert.tsv"
-STEP2_INPUT_FILE_TSV = f"{DOMAIN_NAME}_pair_1st.tsv"
+# TOKENIZE NEW REVIEWS (repeated review texts are analyzed once)
+# encoded holds one entry per sentence (see SPLIT_SENTENCES); segments[i] is (index in texts, character
+# offset in that text) of encoded[i]
+def encode_reviews(predictor: ACOS_Predictor, new_reviews):
+    texts = list({normalize_text(text): text for _, text in new_reviews}.values())
+    encoded, segments = predictor.encode_segments(texts)
+    return texts, encoded, segments
 
 
-# TEMP DIRECTORY SETUP
-def setup_directories():
-    logging.info(f"Setting up temporary directories at {TEMP_DATA_DIR}")
-    if os.path.exists(TEMP_DATA_DIR):
-        shutil.rmtree(TEMP_DATA_DIR)
-    os.makedirs(STEP1_INPUT_DIR, exist_ok=True)
-    os.makedirs(STEP1_OUTPUT_DIR, exist_ok=True)
-    os.makedirs(STEP2_INPUT_DIR, exist_ok=True)
-    os.makedirs(STEP2_OUTPUT_DIR, exist_ok=True)
+# MERGE SENTENCE QUADS INTO (product_id, review_text, quads) OF EVERY REVIEW
+# A review that only differs in case or spacing from the analyzed text gets the spans moved onto its own text.
+def merge_reviews(predictor: ACOS_Predictor, new_reviews, texts, segments, segment_results):
+    merged = predictor.merge_segments(len(texts), segments, segment_results)
+    results = {normalize_text(text): (text, quads) for text, quads in zip(texts, merged)}
+    reviews = []
+    for product_id, text in new_reviews:
+        source, quads = results[normalize_text(text)]
+        reviews.append((product_id, text, remap_spans(quads, source, text)))
+    return reviews
 
 
-# JSONL TO STEP1 INPUT TSV
-def prepare_step1_input(source_jsonl_path: str, output_tsv_path: str):
-    logging.info(f"'{source_jsonl_path}' to STEP1 input TSV at '{output_tsv_path}'")
-    dummy_label = '-1,-1 -1,-1 0 -1,-1'
+# RUN STEP1 -> PAIRS -> STEP2 IN MEMORY ON encode_reviews OUTPUT
+# Tokens, spans and candidate pairs are passed between the steps as Python objects and tensors.
+def infer_reviews(predictor: ACOS_Predictor, new_reviews, texts, encoded, segments,
+                  batch_size: int = PREDICT_BATCH_SIZE):
+    order = sorted(range(len(encoded)), key=lambda i: len(encoded[i][1]))
+    results = [None] * len(encoded)
 
-    line_count = 0
-    error_count = 0
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        batch_encoded = [encoded[i] for i in batch]
+        pairs = predictor.extract_pairs(batch_encoded)
+        for i, quads in zip(batch, predictor.classify_pairs(batch_encoded, pairs)):
+            results[i] = quads
+        logging.debug(f"   > {min(start + batch_size, len(order))}/{len(order)} sentences analyzed")
 
-    try:
-        with open(source_jsonl_path, 'r', encoding='utf-8') as fin, \
-             open(output_tsv_path, 'w', encoding='utf-8') as fout:
-            
-            for line in fin:
-                if not line.strip():
-                    continue
-                
-                try:
-                    data = json.loads(line)
-                    
-                    product_id = data.get("asin")
-                    text = data.get("text")
-                    
-                    if not product_id or not text or text.isspace():
-                        error_count += 1
-                        continue
-                        
-                    product_id = str(product_id).strip()
-                    text = str(text).strip().replace('\n', ' ').replace('\t', ' ')
-                        
-                    fout.write(f"{product_id} @@@ {text}\t{dummy_label}\n")
-                    line_count += 1
-                    
-                except json.JSONDecodeError:
-                    error_count += 1
-                except Exception:
-                    error_count += 1
-
-    except FileNotFoundError:
-        logging.error(f"Error: File not Found: '{source_jsonl_path}")
-        sys.exit(1)
-        
-    if line_count == 0:
-        logging.error(f"Error: No valid reviews.")
-        sys.exit(1)
+    return merge_reviews(predictor, new_reviews, texts, segments, results)
 
-    logging.info(f"Step 1 Complete! Total {line_count} reviews (Error: {error_count})")
-
-
-# RUN STEP1
-def execute_step1():
-    logging.info("Executing ACOS Step 1...")
-
-    args = argparse.Namespace(
-        bert_model=TRAINED_MODEL_STEP1,
-        data_dir=STEP1_INPUT_DIR,
-        task_name='quad',
-        output_dir=STEP1_OUTPUT_DIR,
-        do_train=False,
-        do_eval=True,
-        eval_batch_size=32,
-        max_seq_length=128,
-        model_type='quad',
-        domain_type=DOMAIN_NAME,
-        do_lower_case=True,
-
-        train_batch_size=32,
-        num_train_epochs=10.0,
-        warmup_proportion=0.1,
-        learning_rate=2e-5,
-        no_cuda=False,
-        seed=42,
-        gradient_accumulation_steps=1,
-        fp16=False,
-        loss_scale=0,
-        local_rank=-1
-    )
-
-    original_argv = sys.argv
-    sys.argv = build_argv_from_args(args, "run_step1.py")
 
-    try:
-        run_step1.main()
-        logging.info("ACOS Step 1 Completed Successfully.")
-    except Exception as e:
-        logging.error(f"Error during ACOS Step 1: {e}")
-        logging.error(f"   >Check BERT_BASE_DIR: {BERT_BASE_DIR} or TRAINED_MODEL_STEP1: {TRAINED_MODEL_STEP1}")
-        sys.exit(1)
-    finally:
-        sys.argv = original_argv
+def run_acos(predictor: ACOS_Predictor, new_reviews, batch_size: int = PREDICT_BATCH_SIZE):
+    texts, encoded, segments = encode_reviews(predictor, new_reviews)
+    return infer_reviews(predictor, new_reviews, texts, encoded, segments, batch_size)
 
 
-# STEP1 OUTPUT TO STEP2 INPUT
-def execute_get_pairs():
-    logging.info("Preparing STEP2 input from STEP1 output...")
+# SOURCE IDENTITY FOR THE JOURNAL: absolute path + hash of the first SOURCE_HEAD_BYTES
+def source_identity(source_jsonl_path: str):
+    with open(source_jsonl_path, 'rb') as f:
+        head = hashlib.sha1(f.read(SOURCE_HEAD_BYTES)).hexdigest()
+    return os.path.abspath(source_jsonl_path), head
 
-    args = argparse.Namespace(
-        pred_data_dir=STEP1_OUTPUT_DIR,
-        data_dir=STEP2_INPUT_DIR,
-        domain=DOMAIN_NAME
-    )
 
-    try:
-        get_1st_pairs.main(args)
-        logging.info("STEP2 input preparation completed successfully.")
-    except Exception as e:
-        logging.error(f"Error during STEP2 input preparation: {e}")
-        logging.error(f"   >Check STEP1_OUTPUT_DIR: {STEP1_OUTPUT_DIR}")
-        sys.exit(1)
+# Remember analyzed results, including reviews without any quadruple
+def cache_results(cache: ResultCache, analyzed_reviews):
+    unique = {normalize_text(review_text): (review_text, quads) for _, review_text, quads in analyzed_reviews}
+    cache.put_many([text for text, _ in unique.values()], [quads for _, quads in unique.values()])
 
 
-# RUN STEP2
-def execute_step2():
-    logging.info("Executing ACOS Step 2...")
-
-    args = argparse.Namespace(
-        bert_model=TRAINED_MODEL_STEP2,          
-        data_dir=STEP2_INPUT_DIR,
-        task_name='categorysenti',
-        output_dir=STEP2_OUTPUT_DIR,
-        do_train=False,
-        do_eval=True,
-        eval_batch_size=32,
-        max_seq_length=128,
-        model_type='categorysenti',
-        domain_type=DOMAIN_NAME,
-        do_lower_case=True,
-
-        train_batch_size=32,
-        num_train_epochs=10.0,
-        warmup_proportion=0.1,
-        learning_rate=2e-5,
-        no_cuda=False,
-        seed=42,
-        gradient_accumulation_steps=1,
-        fp16=False,
-        local_rank=-1
-    )
-
-    original_argv = sys.argv
-    sys.argv = build_argv_from_args(args, "run_step2.py")
+# PRODUCER: read, filter and tokenize chunks on a background thread, at most `depth` chunks ahead,
+# so the model is not left waiting on JSON parsing, SQLite lookups or the Python tokenizer.
+# Yields (new_reviews, cached_reviews, skipped, texts, encoded, segments, start_offset, end_offset).
+def iter_prepared_chunks(ranges, cache: ResultCache, get_predictor, stats: Dict[str, int], config: Dict[str, Any],
+                         metrics: StageMetrics = None):
+    prepared = queue.Queue(maxsize=config['prefetch_chunks'])
 
+    def produce():
+        try:
+            # read only: reviews committed before this chunk was read; the writer re-checks at commit
+            conn = sqlite3.connect(config['db_path'])
+            for start_offset, end_offset in ranges:
+                chunks = iter_review_chunks(config['source'], config['chunk_size'], stats, start_offset, end_offset,
+                                            config['reader_processes'], config['reader_block_bytes'])
+                while True:
+                    with measure(metrics, 'read_reviews') as counts:
+                        lines = stats['reviews'] + stats['errors']
+                        item = next(chunks, None)
+                        counts['items_in'] = stats['reviews'] + stats['errors'] - lines
+                        counts['items_out'] = len(item[0]) if item else 0
+                    if item is None:
+                        break
+                    chunk, chunk_start, chunk_end = item
+                    with measure(metrics, 'filter_analyzed', len(chunk)) as counts:
+                        fresh = filter_analyzed(conn, chunk)
+                        counts['items_out'] = len(fresh)
+                    with measure(metrics, 'cache_lookup', len(fresh)) as counts:
+                        new_reviews, cached_reviews = split_cached(fresh, cache)
+                        counts['items_out'] = len(new_reviews)
+                    texts, encoded, segments = encode_reviews(get_predictor(), new_reviews) if new_reviews \
+                        else ([], [], [])
+                    prepared.put(('chunk', (new_reviews, cached_reviews, len(chunk) - len(fresh),
+                                            texts, encoded, segments, chunk_start, chunk_end)))
+            conn.close()
+            prepared.put(('done', None))
+        except (Exception, SystemExit):
+            # SystemExit: load_predictor exits on a missing model, which would otherwise end only this thread
+            prepared.put(('error', traceback.format_exc()))
+
+    threading.Thread(target=produce, name='acos-reader', daemon=True).start()
+    while True:
+        kind, payload = prepared.get()
+        if kind == 'done':
+            return
+        if kind == 'error':
+            raise RuntimeError(f"Reading '{config['source']}' failed:\n{payload}")
+        yield payload
+
+
+class ChunkWriter:
+    """
+    Background DB writer: the only place that writes to FLASK_DB_PATH, RESULT_RECORDS_FILE and the result cache.
+
+    Analyzed chunks are queued with `put` (bounded, so a slow disk throttles inference instead of
+    buffering without limit) and committed in order on a separate thread, one transaction per chunk
+    with its review keys and journal row. Reviews committed since the chunk was read (by an earlier
+    chunk or another shard) are dropped first, so nothing is stored twice.
+    """
+
+    def __init__(self, db_path: str, cache: ResultCache, journal_base: Dict[str, Any], totals: Dict[str, int],
+                 max_pending: int = WRITE_QUEUE_CHUNKS, records_path: str = RESULT_RECORDS_FILE,
+                 metrics: StageMetrics = None):
+        self.cache = cache
+        self.records_path = records_path
+        self.metrics = metrics
+        self.journal_base = journal_base
+        self.totals = totals
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, args=(db_path,), name='acos-db-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, analyzed_reviews, cached_reviews, skipped: int, start_offset: int, end_offset: int):
+        if self.error:
+            raise RuntimeError(f"DB writer failed:\n{self.error}")
+        self._queue.put((analyzed_reviews, cached_reviews, skipped, start_offset, end_offset))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self.error:
+            raise RuntimeError(f"DB writer failed:\n{self.error}")
+
+    def _run(self, db_path: str):
+        conn = sqlite3.connect(db_path)
+        records = open(self.records_path, 'a', encoding='utf-8') if self.records_path else None
+        chunk_id = next_chunk_id(conn, self.journal_base['source'])
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self.error:
+                # keep draining so producers never block on a dead writer
+                continue
+            try:
+                self._write(conn, records, chunk_id, *item)
+                chunk_id += 1
+            except Exception:
+                self.error = traceback.format_exc()
+        if records:
+            records.close()
+        conn.close()
+
+    def _write(self, conn, records, chunk_id, analyzed_reviews, cached_reviews, skipped, start_offset, end_offset):
+        kept = set(filter_analyzed(conn, [review[:2] for review in analyzed_reviews + cached_reviews]))
+        analyzed = [review for review in analyzed_reviews if review[:2] in kept]
+        cached = [review for review in cached_reviews if review[:2] in kept]
+        skipped += len(analyzed_reviews) + len(cached_reviews) - len(analyzed) - len(cached)
+
+        journal_entry = dict(self.journal_base, chunk_id=chunk_id, start_offset=start_offset, end_offset=end_offset)
+        if records:
+            # written before the commit: after a crash the chunk is redone and its records repeat,
+            # which load_records skips, but committed reviews are never missing from the stream
+            with measure(self.metrics, 'records_write', len(analyzed) + len(cached)) as counts:
+                counts['items_out'] = write_records(records, analyzed + cached)
+        with measure(self.metrics, 'db_write', len(analyzed) + len(cached)) as counts:
+            quads = commit_chunk(conn, analyzed + cached, journal_entry)
+            counts['items_out'] = quads
+        self.totals['quads'] += quads
+        with measure(self.metrics, 'cache_write', len(analyzed)) as counts:
+            cache_results(self.cache, analyzed)
+            counts['items_out'] = len(analyzed)
+        self.totals['cached'] += len(cached)
+        self.totals['skipped'] += skipped
+        logging.info(f"--- Chunk {chunk_id} committed: {len(analyzed) + len(cached) + skipped} reviews "
+                     f"({skipped} already in DB, {len(cached)} from cache), bytes {start_offset}-{end_offset}, "
+                     f"{self.totals['quads']} quadruples so far")
+
+
+# SINGLE PROCESS: reader/tokenizer thread -> inference (this thread) -> DB writer thread
+def run_single(cache, journal_base, pending, totals, config: Dict[str, Any], metrics: StageMetrics = None):
+    get_predictor = lazy_predictor(config['predictor_kwargs'], metrics=metrics)
+    writer = ChunkWriter(config['db_path'], cache, journal_base, totals, records_path=config['records_file'],
+                         metrics=metrics)
     try:
-        run_step2.main()
-        logging.info("ACOS Step 2 Completed Successfully.")
-    except Exception as e:
-        logging.error(f"Error during ACOS Step 2: {e}")
-        logging.error(f"   >Check TRAINED_MODEL_STEP2: {TRAINED_MODEL_STEP2}")
-        sys.exit(1)
+        for new_reviews, cached_reviews, skipped, texts, encoded, segments, chunk_start, chunk_end in \
+                iter_prepared_chunks(pending, cache, get_predictor, totals, config, metrics):
+            analyzed_reviews = infer_reviews(get_predictor(), new_reviews, texts, encoded, segments,
+                                             config['batch_size']) if new_reviews else []
+            writer.put(analyzed_reviews, cached_reviews, skipped, chunk_start, chunk_end)
     finally:
-        sys.argv = original_argv
-
-
-# PARSE RESULTS AND LOAD TO DB
-def parse_results_and_load_db(results_dir: str, db_path: str):
-    logging.info(f"DB Loading Started... DB Path: {db_path}")
+        writer.close()
 
-    results_file = os.path.join(results_dir, 'predict_results.json')
 
-    if not os.path.exists(results_file):
-        logging.error(f"Error: Results file not found at '{results_file}'")
-        return
-    
+# SPLIT PENDING RANGES INTO num_shards LISTS OF ABOUT EQUAL BYTES, CUT AT LINE STARTS
+# With an up-to-date sidecar index (review_index.py) the shards get equal numbers of records instead.
+def shard_ranges(source_jsonl_path: str, ranges, num_shards: int):
+    index = open_index(source_jsonl_path)
+    if index is not None:
+        try:
+            return shard_ranges_by_records(index, ranges, num_shards)
+        finally:
+            index.close()
+
+    total = sum(end - start for start, end in ranges)
+    budget = total / num_shards
+    shards = [[] for _ in range(num_shards)]
+    shard = 0
+    filled = 0
+    with open(source_jsonl_path, 'rb') as f:
+        for start, end in ranges:
+            while start < end:
+                cut = end
+                if shard < num_shards - 1 and start + budget - filled < end:
+                    # move the cut to the start of the next line
+                    f.seek(max(int(start + budget - filled), start + 1) - 1)
+                    f.readline()
+                    cut = min(f.tell(), end)
+                shards[shard].append((start, cut))
+                filled += cut - start
+                start = cut
+                if filled >= budget and shard < num_shards - 1:
+                    shard += 1
+                    filled = 0
+    return [ranges for ranges in shards if ranges]
+
+
+def shard_ranges_by_records(index, ranges, num_shards: int):
+    # [first, last) record numbers of each pending range
+    spans = [(start, end, index.record_at_or_after(start), index.record_at_or_after(end)) for start, end in ranges]
+    total = sum(last - first for _, _, first, last in spans)
+    budget = max(1, -(-total // num_shards))
+    shards = [[] for _ in range(num_shards)]
+    shard = 0
+    filled = 0
+    for start, end, first, last in spans:
+        if first == last:
+            # no records (e.g. blank lines left by a failed shard): journaled by the neighbouring shard
+            shards[shard if shards[shard] or shard == 0 else shard - 1].append((start, end))
+            continue
+        while first < last:
+            take = min(last - first, budget - filled)
+            first += take
+            cut = end if first == last else index.offset(first)
+            shards[shard].append((start, cut))
+            filled += take
+            start = cut
+            if filled >= budget and shard < num_shards - 1:
+                shard += 1
+                filled = 0
+    return [ranges for ranges in shards if ranges]
+
+
+# SHARD WORKER PROCESS: analyze its byte ranges and send each chunk to the writer
+# Everything it reads comes from `config` (run_config of the parent), not from this module's globals.
+def shard_worker(shard_id: int, ranges, num_threads: int, out_queue, config: Dict[str, Any],
+                 with_metrics: bool = False):
+    torch.set_num_threads(num_threads)
     try:
-        with open(results_file, 'r', encoding='utf-8') as f:
-            predictions = json.load(f) 
-    except json.JSONDecodeError as e:
-        logging.error(f"Error: '{results_file}' Parsing JSON failed. {e}")
+        cache = ResultCache(config['cache_db'], config['cache_fingerprint'])
+        metrics = StageMetrics() if with_metrics else None
+        get_predictor = lazy_predictor(config['predictor_kwargs'], metrics=metrics)
+        stats = {'reviews': 0, 'errors': 0}
+        for new_reviews, cached_reviews, skipped, texts, encoded, segments, chunk_start, chunk_end in \
+                iter_prepared_chunks(ranges, cache, get_predictor, stats, config, metrics):
+            analyzed_reviews = infer_reviews(get_predictor(), new_reviews, texts, encoded, segments,
+                                             config['batch_size']) if new_reviews else []
+            out_queue.put(('chunk', shard_id, (analyzed_reviews, cached_reviews, skipped, chunk_start, chunk_end)))
+        cache.close()
+        out_queue.put(('done', shard_id, dict(stats, metrics=metrics.snapshot() if metrics else None)))
+    except Exception:
+        out_queue.put(('error', shard_id, traceback.format_exc()))
+
+
+def run_sharded(cache, journal_base, pending, totals, num_workers: int, config: Dict[str, Any],
+                metrics: StageMetrics = None):
+    shards = shard_ranges(config['source'], pending, num_workers)
+    if not shards:
+        # the pending ranges hold no records (blank lines only): journal them without starting workers
+        run_single(cache, journal_base, pending, totals, config, metrics)
         return
+    num_threads = PIPELINE_WORKER_THREADS or max(1, (os.cpu_count() or 1) // len(shards))
+    logging.info(f"Sharded run: {len(shards)} workers x {num_threads} torch threads")
+
+    context = spawn_context()
+    out_queue = context.Queue(maxsize=2 * len(shards))
+    workers = {}
+    for shard_id, ranges in enumerate(shards):
+        workers[shard_id] = context.Process(target=shard_worker,
+                                            args=(shard_id, ranges, num_threads, out_queue, config,
+                                                  metrics is not None),
+                                            name=f'acos-shard-{shard_id}')
+        workers[shard_id].start()
+
+    writer = ChunkWriter(config['db_path'], cache, journal_base, totals, records_path=config['records_file'],
+                         metrics=metrics)
+    failed = []
+    try:
+        while workers:
+            try:
+                kind, shard_id, payload = out_queue.get(timeout=5)
+            except queue.Empty:
+                for shard_id in [i for i, worker in workers.items() if not worker.is_alive()]:
+                    logging.error(f"Error: shard {shard_id} exited with code {workers.pop(shard_id).exitcode}")
+                    failed.append(shard_id)
+                continue
+
+            if kind == 'chunk':
+                writer.put(*payload)
+            elif kind == 'done':
+                totals['reviews'] += payload['reviews']
+                totals['errors'] += payload['errors']
+                if metrics is not None and payload['metrics']:
+                    metrics.merge(payload['metrics'])
+                workers.pop(shard_id).join()
+            else:
+                logging.error(f"Error in shard {shard_id}:\n{payload}")
+                workers.pop(shard_id).join()
+                failed.append(shard_id)
+    finally:
+        writer.close()
+
+    if failed:
+        logging.error(f"Error: shards {sorted(failed)} failed; their committed chunks are kept, rerun to resume the rest")
+        sys.exit(1)
+
+
+# STAGE-PARALLEL: reader/tokenizer thread -> step-1 pool -> step-2 pool -> DB writer thread
+def run_staged(cache, journal_base, pending, totals, config: Dict[str, Any], metrics: StageMetrics = None):
+    # this process only tokenizes; each pool worker loads the model of its own stage
+    get_predictor = lazy_predictor(config['predictor_kwargs'], stages=(), metrics=metrics)
+    num_threads = PIPELINE_WORKER_THREADS or max(1, (os.cpu_count() or 1) // STAGE_WORKERS)
+    logging.info(f"Stage-parallel run: {STAGE_WORKERS} workers x {num_threads} torch threads")
+    pools = StagePools(config['predictor_kwargs'], STAGE_WORKERS, STEP2_BATCH_SIZE, num_threads,
+                       queue_size=2 * STAGE_WORKERS, metrics=metrics)
+    writer = ChunkWriter(config['db_path'], cache, journal_base, totals, records_path=config['records_file'],
+                         metrics=metrics)
+
+    # chunk sequence number -> state of a chunk whose sentences are in the pools
+    chunks = {}
+    lock = threading.Lock()
+    feeder = {'done': False, 'error': None}
 
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS acos_results (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        product_id TEXT NOT NULL,
-        review_text TEXT,
-        aspect TEXT,
-        opinion TEXT,
-        category TEXT,
-        sentiment INTEGER
-    )
-    ''')
-
-    sentiment_map = {"Negative": 0, "Neutral": 1, "Positive": 2, "negative": 0, "neutral": 1, "positive": 2}
-
-    processed_count = 0
-    
-    for item in predictions:
+    def feed():
         try:
-            full_text, aspect, opinion, category, sentiment_str = item
-            
-            if ' @@@ ' not in full_text:
-                logging.warning(f"Warning: no ' @@@ ' exists. Skip: {full_text}")
-                continue
-                
-            product_id, review_text = full_text.split(' @@@ ', 1)
-            
-            sentiment_int = sentiment_map.get(sentiment_str, -1)
-            
-            cursor.execute(
-                "INSERT INTO acos_results (product_id, review_text, aspect, opinion, category, sentiment) VALUES (?, ?, ?, ?, ?, ?)",
-                (product_id, review_text, aspect, opinion, category, sentiment_int)
-            )
-            processed_count += 1
-            
-        except ValueError as e:
-            logging.warning(f"Warning: Parsing Error. Skip. item: {item}, error: {e}")
-        except Exception as e:
-            logging.error(f"error: {e}")
-
-    conn.commit()
-    conn.close()
-    
-    logging.info(f"--- DB Saving Complete: Total {processed_count} ACOS Quadruples Saved")
-
-
-def main_pipeline():
+            for seq, (new_reviews, cached_reviews, skipped, texts, encoded, segments, chunk_start, chunk_end) in \
+                    enumerate(iter_prepared_chunks(pending, cache, get_predictor, totals, config, metrics)):
+                if not texts:
+                    writer.put([], cached_reviews, skipped, chunk_start, chunk_end)
+                    continue
+                with lock:
+                    chunks[seq] = {'new': new_reviews, 'cached': cached_reviews, 'skipped': skipped, 'texts': texts,
+                                   'segments': segments, 'results': {}, 'start': chunk_start, 'end': chunk_end}
+                order = sorted(range(len(encoded)), key=lambda i: len(encoded[i][1]))
+                for start in range(0, len(order), STEP1_BATCH_SIZE):
+                    batch = order[start:start + STEP1_BATCH_SIZE]
+                    pools.submit([(seq, i) for i in batch], [encoded[i] for i in batch])
+        except Exception:
+            feeder['error'] = traceback.format_exc()
+        feeder['done'] = True
+
+    feed_thread = threading.Thread(target=feed, name='acos-feeder', daemon=True)
+    try:
+        feed_thread.start()
+        last_rebalance = time.monotonic()
+        while True:
+            for (seq, i), quads in pools.poll(timeout=1.0):
+                with lock:
+                    chunk = chunks[seq]
+                    chunk['results'][i] = quads
+                    if len(chunk['results']) < len(chunk['segments']):
+                        continue
+                    del chunks[seq]
+                results = [chunk['results'][i] for i in range(len(chunk['segments']))]
+                analyzed_reviews = merge_reviews(get_predictor(), chunk['new'], chunk['texts'], chunk['segments'], results)
+                writer.put(analyzed_reviews, chunk['cached'], chunk['skipped'], chunk['start'], chunk['end'])
+
+            if feeder['error']:
+                raise RuntimeError(f"Feeding the stage pools failed:\n{feeder['error']}")
+            with lock:
+                if feeder['done'] and not chunks:
+                    break
+            pools.check_workers()
+            if time.monotonic() - last_rebalance >= STAGE_REBALANCE_SECONDS:
+                pools.rebalance()
+                last_rebalance = time.monotonic()
+        pools.close()
+    except BaseException:
+        pools.terminate()
+        raise
+    finally:
+        writer.close()
+
+
+# RUN REPORT JSON NEXT TO FLASK_DB_PATH (see RUN_REPORT)
+def write_run_report(run: Dict[str, Any], mode: str, num_workers: int, file_size: int, pending, totals: Dict[str, int],
+                     metrics: StageMetrics):
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    report = {
+        'status': run['status'],
+        'started_at': run['started_at'],
+        'finished_at': datetime.now().isoformat(timespec='seconds'),
+        'wall_seconds': time.perf_counter() - run['wall'],
+        # this process, plus worker processes that have exited (sharded and stage-parallel runs)
+        'cpu_seconds': time.process_time() - run['cpu'] + children.ru_utime + children.ru_stime,
+        'peak_rss_mb': {'self': peak_rss_mb(), 'children': peak_rss_mb(resource.RUSAGE_CHILDREN)},
+        'source': {'path': os.path.abspath(NEW_REVIEW_FILE), 'bytes': file_size, 'compressed': is_compressed(NEW_REVIEW_FILE),
+                   'pending_bytes': None if file_size is None else sum(end - start for start, end in pending)},
+        'db': os.path.abspath(FLASK_DB_PATH),
+        'config': {
+            'mode': mode, 'pipeline_workers': num_workers, 'stage_workers': STAGE_WORKERS,
+            'torch_threads': torch.get_num_threads(), 'chunk_size': CHUNK_SIZE,
+            'reader_processes': READER_PROCESSES, 'json_backend': JSON_BACKEND,
+            'predict_batch_size': PREDICT_BATCH_SIZE, 'step1_batch_size': STEP1_BATCH_SIZE,
+            'step2_batch_size': STEP2_BATCH_SIZE, 'max_seq_length': MAX_SEQ_LENGTH,
+            'quantize': QUANTIZE_INFERENCE, 'model_step1': TRAINED_MODEL_STEP1, 'model_step2': TRAINED_MODEL_STEP2,
+        },
+        'totals': totals,
+        # wall/cpu seconds are summed over calls, so stages of parallel workers can add up to more than the run
+        'stages': metrics.report(),
+    }
+    path = os.path.splitext(FLASK_DB_PATH)[0] + datetime.now().strftime('_run_%Y%m%d_%H%M%S.json')
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        logging.info(f"Run report saved to '{path}'")
+    except OSError as e:
+        logging.warning(f"Warning: could not write run report '{path}': {e}")
+
+
+def main_pipeline(num_workers: int = PIPELINE_WORKERS):
 
     logging.info("======================================")
     logging.info("   ACOS PIPELINE AND DB LOADING START   ")
     logging.info(f"   DATASET: {NEW_REVIEW_FILE}    ")
     logging.info("======================================")
 
-    setup_directories()
+    if not os.path.exists(NEW_REVIEW_FILE):
+        logging.error(f"Error: File not Found: '{NEW_REVIEW_FILE}")
+        sys.exit(1)
 
-    step1_input_path = os.path.join(STEP1_INPUT_DIR, STEP1_INPUT_FILE_TSV)
-    prepare_step1_input(NEW_REVIEW_FILE, step1_input_path)
+    cache = ResultCache(RESULT_CACHE_DB, cache_fingerprint())
+    conn = open_results_db(FLASK_DB_PATH)
+
+    source, source_head = source_identity(NEW_REVIEW_FILE)
+    # None for a compressed file: its decompressed size is only known at the end of the stream
+    file_size = input_size(NEW_REVIEW_FILE)
+    pending = [(0, file_size)]
+    if RESUME_FROM_JOURNAL:
+        pending = journal_pending_ranges(conn, source, source_head, file_size)
+        if pending != [(0, file_size)]:
+            if file_size is None:
+                logging.info(f"Resuming: from byte {pending[-1][0]} of the decompressed stream "
+                             f"(+{len(pending) - 1} earlier ranges)")
+            else:
+                logging.info(f"Resuming: {sum(end - start for start, end in pending)} of {file_size} bytes left "
+                             f"in {len(pending)} ranges")
+
+    journal_base = {'source': source, 'source_head': source_head}
+    totals = {'reviews': 0, 'errors': 0, 'skipped': 0, 'cached': 0, 'quads': 0}
+    metrics = StageMetrics() if RUN_REPORT else None
+    if num_workers > 1 and file_size is None and not STAGE_PARALLEL:
+        logging.warning("Warning: a compressed input cannot be split into shards; reading it in one process")
+        num_workers = 1
+    mode = 'staged' if STAGE_PARALLEL and pending else 'sharded' if num_workers > 1 and pending else 'single'
+    # worker processes run on CPU
+    config = run_config(torch.device("cpu") if mode != 'single' else None)
+    run = {'started_at': datetime.now().isoformat(timespec='seconds'), 'status': 'failed',
+           'wall': time.perf_counter(), 'cpu': time.process_time()}
+    try:
+        if mode == 'staged':
+            run_staged(cache, journal_base, pending, totals, config, metrics)
+        elif mode == 'sharded':
+            run_sharded(cache, journal_base, pending, totals, num_workers, config, metrics)
+        else:
+            run_single(cache, journal_base, pending, totals, config, metrics)
+        run['status'] = 'completed'
+    finally:
+        conn.close()
+        cache.close()
+        if metrics is not None:
+            write_run_report(run, mode, num_workers, file_size, pending, totals, metrics)
+
+    if totals['reviews'] == 0:
+        if pending != [(0, file_size)]:
+            logging.info(f"No new reviews; '{FLASK_DB_PATH}' is up to date.")
+            return
+        logging.error(f"Error: No valid reviews. (Error: {totals['errors']})")
+        sys.exit(1)
 
-    execute_step1()
+    logging.info("======================================")
+    logging.info(f"    Pipeline Completed. {totals['reviews']} reviews ({totals['skipped']} already in DB, "
+                 f"{totals['cached']} from cache, Error: {totals['errors']})")
+    logging.info(f"    {totals['quads']} ACOS Quadruples are saved in '{FLASK_DB_PATH}'  ")
+    logging.info("======================================")
 
-    execute_get_pairs()
 
-    execute_step2()
+# REANALYZE PRODUCTS: replace the results of these asins with a fresh analysis of their reviews in
+# NEW_REVIEW_FILE, read through the sidecar index (built on first use) instead of scanning the file.
+# The journal is left as it is; the next main_pipeline run skips these reviews as already analyzed.
+def reanalyze_products(asins: List[str]):
+    if not os.path.exists(NEW_REVIEW_FILE):
+        logging.error(f"Error: File not Found: '{NEW_REVIEW_FILE}")
+        sys.exit(1)
 
-    parse_results_and_load_db(STEP2_OUTPUT_DIR, FLASK_DB_PATH)
+    index = open_index(NEW_REVIEW_FILE, require_asins=True)
+    if index is None:
+        logging.info(f"Building review index for '{NEW_REVIEW_FILE}'...")
+        index = build_index(NEW_REVIEW_FILE, by_asin=True, processes=READER_PROCESSES)
+    try:
+        offsets = [offset for asin in asins for offset in index.asin_offsets(asin)]
+    finally:
+        index.close()
 
-    logging.info("======================================")
-    logging.info(f"    Pipeline Completed. Results are saved in '{FLASK_DB_PATH}'  ")
-    logging.info("======================================")
+    reviews = [review for review in (parse_review(line) for _, line in read_records(NEW_REVIEW_FILE, offsets))
+               if review is not None and review[0] in asins]
+    if not reviews:
+        logging.warning(f"Warning: no reviews of {', '.join(asins)} in '{NEW_REVIEW_FILE}'; results left as they are")
+        return
+    logging.info(f"Reanalyzing {len(reviews)} reviews of {len(asins)} products")
 
+    # one analysis per distinct review, as filter_analyzed keeps them
+    reviews = list({(product_id, text_hash(text)): (product_id, text) for product_id, text in reviews}.values())
+
+    cache = ResultCache(RESULT_CACHE_DB, cache_fingerprint())
+    conn = open_results_db(FLASK_DB_PATH)
+    try:
+        new_reviews, cached_reviews = split_cached(reviews, cache)
+        analyzed_reviews = run_acos(load_predictor(), new_reviews) if new_reviews else []
+        # old rows go in the same transaction as the new ones
+        deleted = delete_products(conn, asins)
+        quads = commit_chunk(conn, analyzed_reviews + cached_reviews)
+        cache_results(cache, analyzed_reviews)
+    finally:
+        conn.close()
+        cache.close()
+    logging.info(f"Replaced {deleted} rows of {len(asins)} products with {quads} ACOS Quadruples "
+                 f"({len(cached_reviews)} reviews from cache)")
 
-if __name__ == "__main__":
-    main_pipeline()
 
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Analyze NEW_REVIEW_FILE into FLASK_DB_PATH.")
+    parser.add_argument('--workers', type=int, default=PIPELINE_WORKERS, help="Shard worker processes.")
+    parser.add_argument('--reanalyze', type=str, nargs='+', default=None, metavar='ASIN',
+                        help="Only replace the results of these products (uses the review index).")
+    args = parser.parse_args()
+    if args.reanalyze:
+        reanalyze_products(args.reanalyze)
+    else:
+        main_pipeline(args.workers)
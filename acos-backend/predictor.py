@@ -0,0 +1,530 @@
+import os
+import re
+import sys
+import json
+import logging
+import unicodedata
+from typing import List, Dict, Any, Iterator, Tuple, Optional
+
+import torch
+
+# ACOS CODE IMPORT
+ACOS_CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ACOS-main', 'Extract-Classify-ACOS')
+if ACOS_CODE_DIR not in sys.path:
+    sys.path.insert(0, ACOS_CODE_DIR)
+
+from bert_utils.tokenization import BertTokenizer
+
+from result_cache import ResultCache, model_fingerprint, normalize_text, remap_spans
+from stage_metrics import StageMetrics, measure
+
+logger = logging.getLogger(__name__)
+
+# STEP1 CRF TAG PATTERNS (B-A I-A* / B-O I-O*, same as eval_metrics.pred_eval)
+ASPECT_TAG_PATTERN = re.compile(r'32*')
+OPINION_TAG_PATTERN = re.compile(r'54*')
+
+# IMPLICIT ASPECT / OPINION SPAN AND SURFACE FORM
+IMPLICIT_SPAN = (-1, -1)
+IMPLICIT_TEXT = 'NULL'
+
+SENTIMENT_NAMES = {'0': 'Negative', '1': 'Neutral', '2': 'Positive'}
+
+UNK_TOKEN = '[UNK]'
+
+# encode_segments() output per segment: wordpiece tokens, '[CLS] ... [CLS]' input ids,
+# and the [start, end) character offsets of each token in the segment (None if unaligned)
+Encoded = Tuple[List[str], List[int], List[Optional[Tuple[int, int]]]]
+
+# SENTENCE SEGMENTATION (see encode_segments): a boundary is end punctuation, optionally closing
+# quotes/brackets, then whitespace; not after these abbreviations or a single letter ("U.S. made")
+SENTENCE_END_PATTERN = re.compile(r'[.!?\u2026]+["\'\)\]\u201d\u2019]*(?=\s)')
+LAST_WORD_PATTERN = re.compile(r'\S+$')
+NON_FINAL_ABBREVIATIONS = {'mr', 'mrs', 'ms', 'dr', 'st', 'vs', 'etc', 'e.g', 'i.e', 'approx', 'no', 'jr', 'sr'}
+# appended to the cache fingerprint: segmented results differ from whole-text results
+SEGMENTED_SCOPE = ':sentences'
+
+# TORCHSCRIPT EXPORT FILES (written by export_torchscript.py)
+TORCHSCRIPT_STEP1 = 'step1.pt'
+TORCHSCRIPT_STEP2 = 'step2.pt'
+TORCHSCRIPT_META = 'acos_meta.json'
+
+
+class ACOS_Predictor:
+    """
+    In-memory ACOS quadruple extractor.
+
+    Both fine-tuned models are loaded once; step-1 tagging, aspect/opinion pairing
+    and step-2 category-sentiment classification are chained on tensors, without the
+    TSV files and argv round-trips of pipeline.py.
+    """
+
+    # per-stage timings and counters are recorded here when set (see pipeline.py RUN_REPORT)
+    metrics: StageMetrics = None
+
+    def __init__(self, model_dir_step1: str, model_dir_step2: str, domain_type: str = 'rest16',
+                 max_seq_length: int = 128, device=None, cache_path: str = None, quantize: bool = False,
+                 stages: Tuple[int, ...] = (1, 2), segment_sentences: bool = False):
+        # `stages` limits which models are loaded (e.g. (1,) for a step-1 worker, () for tokenization only)
+        # `segment_sentences`: analyze texts sentence by sentence (see encode_segments); off by default,
+        # so sentence-level test sets are analyzed as the models were trained and evaluated
+        # modeling.py is only needed for the eager models, not by TorchScriptPredictor
+        from modeling import BertForQuadABSA, CategorySentiClassification, quantize_bert_dynamic
+        from run_classifier_dataset_utils import QuadProcessor, CategorySentiProcessor
+
+        logger.info("Initializing ACOS Predictor...")
+        self.device = device if device is not None else torch.device("cpu")
+        if quantize and self.device.type != 'cpu':
+            raise ValueError("Int8 dynamic quantization is CPU only, got device {}".format(self.device))
+        self.max_seq_length = max_seq_length
+        self.segment_sentences = segment_sentences
+
+        quad_labels = QuadProcessor().get_labels(domain_type)
+        catesenti_labels = CategorySentiProcessor().get_labels(domain_type)
+        self.label_map_seq = {label: i for i, label in enumerate(quad_labels[1])}
+        self.catesenti_dict = {i: label for i, label in enumerate(catesenti_labels[0])}
+
+        self.tokenizer = BertTokenizer.from_pretrained(model_dir_step1, do_lower_case=True)
+        self.model_step1 = None
+        self.model_step2 = None
+        if 1 in stages:
+            self.model_step1 = BertForQuadABSA.from_pretrained(model_dir_step1, num_labels=len(quad_labels[1]))
+        if 2 in stages:
+            self.model_step2 = CategorySentiClassification.from_pretrained(model_dir_step2,
+                                                                           num_labels=len(catesenti_labels[0]))
+        for model in (self.model_step1, self.model_step2):
+            if model is None:
+                continue
+            if quantize:
+                quantize_bert_dynamic(model)
+            model.to(self.device)
+            model.eval()
+        logger.info("Models loaded successfully.")
+
+        self.fingerprint = model_fingerprint(model_dir_step1, model_dir_step2, variant='int8' if quantize else '')
+        self._init_cache(cache_path)
+
+    def _init_cache(self, cache_path: str):
+        # results of already-seen review texts, keyed by normalized text and model fingerprint
+        scope = self.fingerprint + (SEGMENTED_SCOPE if self.segment_sentences else '')
+        self.cache = ResultCache(cache_path, scope) if cache_path else None
+
+    # --- Public API ---
+    def predict(self, sentence: str) -> List[Dict[str, Any]]:
+        return self.predict_batch([sentence])[0]
+
+    def predict_batch(self, sentences: List[str]) -> List[List[Dict[str, Any]]]:
+        results = [None] * len(sentences)
+        for index, quads in self.predict_stream(sentences, batch_size=max(len(sentences), 1)):
+            results[index] = quads
+        return results
+
+    def predict_stream(self, sentences: List[str], batch_size: int = 32) -> Iterator[Tuple[int, List[Dict[str, Any]]]]:
+        """
+        Yields (input index, quads) for each text as soon as the batches of all its segments finish.
+        Cache hits come first; the rest is batched in order of wordpiece length,
+        so results are not in input order.
+        """
+        cached = self.cache.get_many(sentences) if self.cache else [None] * len(sentences)
+        # repeated texts within the request are analyzed once; spans are remapped onto each variant
+        pending = {}
+        for index, (sentence, quads) in enumerate(zip(sentences, cached)):
+            if quads is not None:
+                yield index, quads
+            else:
+                pending.setdefault(normalize_text(sentence), []).append(index)
+
+        groups = list(pending.values())
+        encoded, segments = self.encode_segments([sentences[group[0]] for group in groups])
+        # segments of one text are contiguous in encode_segments output: [first, end) per text
+        bounds = [[len(segments), 0] for _ in groups]
+        for i, (group, _) in enumerate(segments):
+            bounds[group][0] = min(bounds[group][0], i)
+            bounds[group][1] = i + 1
+        remaining = [end - first for first, end in bounds]
+        segment_results = [None] * len(encoded)
+        order = sorted(range(len(encoded)), key=lambda i: len(encoded[i][1]))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            finished = []
+            for i, quads in zip(batch, self._analyze([encoded[i] for i in batch])):
+                segment_results[i] = quads
+                group = segments[i][0]
+                remaining[group] -= 1
+                if remaining[group] == 0:
+                    finished.append(group)
+            if not finished:
+                continue
+            batch_results = []
+            for group in finished:
+                first, end = bounds[group]
+                batch_results.append(self.merge_segments(1, [(0, offset) for _, offset in segments[first:end]],
+                                                         segment_results[first:end])[0])
+            if self.cache:
+                self.cache.put_many([sentences[groups[group][0]] for group in finished], batch_results)
+            for group, quads in zip(finished, batch_results):
+                source = sentences[groups[group][0]]
+                for index in groups[group]:
+                    yield index, remap_spans(quads, source, sentences[index])
+
+    def _analyze(self, encoded: List[Encoded]) -> List[List[Dict[str, Any]]]:
+        return self.classify_pairs(encoded, self.extract_pairs(encoded))
+
+    # --- Step-level API (library replacement for run_step1 -> get_1st_pairs -> run_step2) ---
+    def encode_segments(self, texts: List[str]) -> Tuple[List[Encoded], List[Tuple[int, int]]]:
+        """
+        Wordpiece tokens, '[CLS] ... [CLS]' input ids (as built by convert_examples_to_features) and token
+        character offsets of the sentences of each text (the whole text if segment_sentences is off), shared
+        by both steps; and (text index, character offset of the segment in the text) of each entry, text by text.
+        A sentence longer than max_seq_length - 2 wordpieces is cut into windows at word starts,
+        so nothing past the model's sequence limit is dropped.
+        """
+        limit = self.max_seq_length - 2
+        encoded, segments = [], []
+        with measure(self.metrics, 'tokenize', len(texts)) as counts:
+            for index, text in enumerate(texts):
+                spans = sentence_spans(text) if self.segment_sentences else [(0, len(text))]
+                for start, end in spans or [(0, len(text))]:
+                    sentence = text[start:end]
+                    tokens = self.tokenizer.tokenize(sentence)
+                    offsets = token_char_offsets(sentence, tokens)
+                    for first, last in _token_windows(tokens, offsets, limit):
+                        base = next((offset[0] for offset in offsets[first:last] if offset is not None), 0)
+                        window_offsets = [None if offset is None else (offset[0] - base, offset[1] - base)
+                                          for offset in offsets[first:last]]
+                        window_ids = self.tokenizer.convert_tokens_to_ids(['[CLS]'] + tokens[first:last] + ['[CLS]'])
+                        encoded.append((tokens[first:last], window_ids, window_offsets))
+                        segments.append((index, start + base))
+            counts['items_out'] = len(encoded)
+            counts['tokens'] = sum(len(tokens) for tokens, _, _ in encoded)
+        return encoded, segments
+
+    @staticmethod
+    def merge_segments(num_texts: int, segments: List[Tuple[int, int]],
+                       results: List[List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+        """
+        Quads per text from the `encode_segments` entries' quads: spans are moved to text offsets and
+        a quad found in several segments is kept once, with its best score.
+        """
+        merged = [[] for _ in range(num_texts)]
+        seen = [{} for _ in range(num_texts)]
+        for (index, offset), quads in zip(segments, results):
+            for quad in quads:
+                quad = dict(quad)
+                for field in ('aspect_span', 'opinion_span'):
+                    if quad.get(field) is not None:
+                        quad[field] = [quad[field][0] + offset, quad[field][1] + offset]
+                key = (quad['aspect'], quad['category'], quad['opinion'], quad['sentiment'])
+                if key not in seen[index]:
+                    seen[index][key] = quad
+                    merged[index].append(quad)
+                elif quad['score'] > seen[index][key]['score']:
+                    seen[index][key].update(quad)
+        return merged
+
+    def extract_pairs(self, encoded: List[Encoded]) -> List[Tuple[int, Tuple[int, int], Tuple[int, int]]]:
+        """
+        STEP1 on one batch of `encode_segments` output: (sentence index, aspect span, opinion span) candidates.
+        Spans are wordpiece [start, end) offsets; IMPLICIT_SPAN marks an implicit aspect/opinion.
+        """
+        spans = self._extract_spans([item[1] for item in encoded])
+        with measure(self.metrics, 'pair_generation', len(spans)) as counts:
+            pairs = self._make_pairs(spans)
+            counts['items_out'] = len(pairs)
+        return pairs
+
+    def classify_pairs(self, encoded: List[Encoded], pairs) -> List[List[Dict[str, Any]]]:
+        """
+        STEP2 on the `extract_pairs` candidates of the same batch: ACOS quads per sentence.
+        Besides the surface forms, each quad has 'aspect_span' / 'opinion_span', the [start, end)
+        character offsets in the original sentence (None when implicit), and 'score', the
+        sigmoid probability of its category#sentiment label.
+        """
+        with measure(self.metrics, 'step2_forward', len(pairs)) as counts:
+            logits = self._classify_pairs([item[1] for item in encoded], pairs)
+            counts['items_out'] = int((logits > 0).sum())
+            sentence_ids = [encoded[index][1] for index in {index for index, _, _ in pairs}]
+            counts['tokens'] = sum(len(ids) for ids in sentence_ids)
+            counts['padded_tokens'] = len(sentence_ids) * max((len(ids) for ids in sentence_ids), default=0)
+
+        results = [[] for _ in encoded]
+        seen = [{} for _ in encoded]
+        for (index, aspect, opinion), pair_logits in zip(pairs, logits):
+            tokens, _, offsets = encoded[index]
+            scores = torch.sigmoid(pair_logits)
+            for label_index in torch.nonzero(pair_logits > 0, as_tuple=False).view(-1).tolist():
+                category, senti = self.catesenti_dict[label_index].rsplit('#', 1)
+                quad = {
+                    'aspect': self._span_text(tokens, aspect),
+                    'category': category,
+                    'opinion': self._span_text(tokens, opinion),
+                    'sentiment': SENTIMENT_NAMES[senti],
+                    'aspect_span': self._span_offsets(offsets, aspect),
+                    'opinion_span': self._span_offsets(offsets, opinion),
+                    'score': round(float(scores[label_index]), 4),
+                }
+                # the same quad from another candidate pair keeps its best score
+                key = (quad['aspect'], quad['category'], quad['opinion'], quad['sentiment'])
+                if key not in seen[index]:
+                    seen[index][key] = quad
+                    results[index].append(quad)
+                elif quad['score'] > seen[index][key]['score']:
+                    seen[index][key].update(quad)
+        return results
+
+    # --- Tokenization ---
+    def _pad(self, batch_ids: List[List[int]]) -> Tuple[torch.Tensor, torch.Tensor]:
+        max_len = max(len(ids) for ids in batch_ids)
+        input_ids = torch.zeros((len(batch_ids), max_len), dtype=torch.long)
+        input_mask = torch.zeros((len(batch_ids), max_len), dtype=torch.long)
+        for i, ids in enumerate(batch_ids):
+            input_ids[i, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+            input_mask[i, :len(ids)] = 1
+        return input_ids.to(self.device), input_mask.to(self.device)
+
+    # --- STEP1: aspect / opinion span extraction ---
+    def _extract_spans(self, batch_ids: List[List[int]]):
+        if not batch_ids:
+            return []
+        input_ids, input_mask = self._pad(batch_ids)
+        with measure(self.metrics, 'step1_forward', len(batch_ids)) as counts:
+            with torch.no_grad():
+                emissions, imp_aspect, imp_opinion = self._step1_emissions(input_ids, input_mask)
+            if self.metrics is not None and self.device.type == 'cuda':
+                # kernels run asynchronously; without this their time shows up under crf_decode
+                torch.cuda.synchronize(self.device)
+            counts['items_out'] = len(batch_ids)
+            counts['tokens'] = sum(len(ids) for ids in batch_ids)
+            counts['padded_tokens'] = input_ids.numel()
+        with measure(self.metrics, 'crf_decode', len(batch_ids)) as counts:
+            with torch.no_grad():
+                pred_tags = self._crf_decode(emissions, input_mask)
+            counts['items_out'] = len(pred_tags)
+        imp_aspect = torch.argmax(imp_aspect, dim=-1).tolist()
+        imp_opinion = torch.argmax(imp_opinion, dim=-1).tolist()
+
+        spans = []
+        for i, tags in enumerate(pred_tags):
+            tag_string = ''.join(str(tag) for tag in tags)
+            # position 0 is the leading [CLS], so shift back to token indices
+            aspects = [(m.start() - 1, m.end() - 1) for m in ASPECT_TAG_PATTERN.finditer(tag_string)]
+            opinions = [(m.start() - 1, m.end() - 1) for m in OPINION_TAG_PATTERN.finditer(tag_string)]
+            if imp_aspect[i] == 1:
+                aspects.append(IMPLICIT_SPAN)
+            if imp_opinion[i] == 1:
+                opinions.append(IMPLICIT_SPAN)
+            spans.append((aspects, opinions))
+        return spans
+
+    # --- STEP1 -> STEP2: candidate pairs (same rules as get_1st_pairs.main) ---
+    @staticmethod
+    def _make_pairs(spans):
+        pairs = []
+        for index, (aspects, opinions) in enumerate(spans):
+            if not aspects and not opinions:
+                continue
+            for aspect in aspects or [IMPLICIT_SPAN]:
+                for opinion in opinions or [IMPLICIT_SPAN]:
+                    pairs.append((index, aspect, opinion))
+        return pairs
+
+    # --- STEP2: category-sentiment classification ---
+    def _classify_pairs(self, batch_ids: List[List[int]], pairs) -> torch.Tensor:
+        if not pairs:
+            return torch.zeros((0, len(self.catesenti_dict)))
+        # encode each sentence once and gather the spans of all its pairs from the shared states
+        sentence_indices = sorted({index for index, _, _ in pairs})
+        sentence_row = {index: row for row, index in enumerate(sentence_indices)}
+        input_ids, input_mask = self._pad([batch_ids[index] for index in sentence_indices])
+        pair_index = torch.tensor([sentence_row[index] for index, _, _ in pairs], dtype=torch.long)
+
+        candidate_aspect = torch.zeros((len(pairs), input_ids.size(1)), dtype=torch.long)
+        candidate_opinion = torch.zeros((len(pairs), input_ids.size(1)), dtype=torch.long)
+        for i, (index, aspect, opinion) in enumerate(pairs):
+            # implicit aspect -> leading [CLS], implicit opinion -> trailing [CLS]
+            # (see convert_examples_to_features2nd)
+            if aspect == IMPLICIT_SPAN:
+                candidate_aspect[i, 0] = 1
+            else:
+                candidate_aspect[i, aspect[0] + 1:aspect[1] + 1] = 1
+            if opinion == IMPLICIT_SPAN:
+                candidate_opinion[i, len(batch_ids[index]) - 1] = 1
+            else:
+                candidate_opinion[i, opinion[0] + 1:opinion[1] + 1] = 1
+        with torch.no_grad():
+            logits = self._step2_forward(input_ids, input_mask, pair_index.to(self.device),
+                                         candidate_aspect.to(self.device), candidate_opinion.to(self.device))
+        return logits.cpu()
+
+    # --- Model calls (overridden by TorchScriptPredictor) ---
+    def _step1_emissions(self, input_ids, input_mask):
+        # encoder half of step 1 (BertForQuadABSA._emissions): CRF emissions and implicit aspect/opinion logits;
+        # the Viterbi pass runs in _crf_decode (the model's CRF here, plain-torch viterbi_decode in TorchScript)
+        return self.model_step1._emissions(input_ids, torch.zeros_like(input_ids), input_mask)
+
+    def _crf_decode(self, emissions, input_mask):
+        return self.model_step1.crf.decode(emissions, mask=input_mask.byte())
+
+    def _step2_forward(self, input_ids, input_mask, pair_index, candidate_aspect, candidate_opinion):
+        return self.model_step2.classify_shared(input_ids, torch.zeros_like(input_ids), input_mask,
+                                                pair_index, candidate_aspect, candidate_opinion)
+
+    @staticmethod
+    def _span_text(tokens: List[str], span) -> str:
+        if span == IMPLICIT_SPAN:
+            return IMPLICIT_TEXT
+        return ' '.join(tokens[span[0]:span[1]]).replace(' ##', '')
+
+    @staticmethod
+    def _span_offsets(offsets, span) -> Optional[List[int]]:
+        if span == IMPLICIT_SPAN or offsets[span[0]] is None or offsets[span[1] - 1] is None:
+            return None
+        return [offsets[span[0]][0], offsets[span[1] - 1][1]]
+
+
+class TorchScriptPredictor(ACOS_Predictor):
+    """
+    ACOS_Predictor over the frozen TorchScript graphs written by export_torchscript.py.
+
+    Only torch and the tokenizer are needed: modeling.py is never imported. The traced step-1
+    graph returns CRF emissions, which are Viterbi-decoded here with the exported transitions.
+    """
+
+    def __init__(self, export_dir: str, device=None, cache_path: str = None, segment_sentences: bool = False):
+        logger.info(f"Loading TorchScript ACOS models from '{export_dir}'...")
+        self.device = device if device is not None else torch.device("cpu")
+        self.segment_sentences = segment_sentences
+        extra_files = {TORCHSCRIPT_META: ''}
+        self.model_step1 = torch.jit.load(os.path.join(export_dir, TORCHSCRIPT_STEP1),
+                                          map_location=self.device, _extra_files=extra_files)
+        self.model_step2 = torch.jit.load(os.path.join(export_dir, TORCHSCRIPT_STEP2), map_location=self.device)
+        meta = json.loads(extra_files[TORCHSCRIPT_META])
+
+        self.max_seq_length = meta['max_seq_length']
+        self.label_map_seq = {label: i for i, label in enumerate(meta['seq_labels'])}
+        self.catesenti_dict = {i: label for i, label in enumerate(meta['catesenti_labels'])}
+        self.crf_start_transitions = torch.tensor(meta['crf_start_transitions'], device=self.device)
+        self.crf_end_transitions = torch.tensor(meta['crf_end_transitions'], device=self.device)
+        self.crf_transitions = torch.tensor(meta['crf_transitions'], device=self.device)
+        self.tokenizer = BertTokenizer.from_pretrained(export_dir, do_lower_case=True)
+        logger.info("Models loaded successfully.")
+
+        # same checkpoints as the eager predictor, so the cached results are shared with it
+        self.fingerprint = meta['fingerprint']
+        self._init_cache(cache_path)
+
+    def _step1_emissions(self, input_ids, input_mask):
+        return self.model_step1(input_ids, torch.zeros_like(input_ids), input_mask)
+
+    def _crf_decode(self, emissions, input_mask):
+        return viterbi_decode(emissions, input_mask.bool(), self.crf_start_transitions,
+                              self.crf_end_transitions, self.crf_transitions)
+
+    def _step2_forward(self, input_ids, input_mask, pair_index, candidate_aspect, candidate_opinion):
+        return self.model_step2(input_ids, torch.zeros_like(input_ids), input_mask,
+                                pair_index, candidate_aspect, candidate_opinion)
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """[start, end) character spans of the sentences of `text`, without surrounding whitespace."""
+    spans = []
+    start = 0
+    for match in SENTENCE_END_PATTERN.finditer(text):
+        word = LAST_WORD_PATTERN.search(text, max(start, match.start() - 32), match.start())
+        word = word.group().lower().lstrip('"\'(') if word else ''
+        # "U.S.", "e.g." and the like: only single letters between the dots
+        if match.group()[0] == '.' and (word in NON_FINAL_ABBREVIATIONS
+                                        or all(len(part) <= 1 for part in word.split('.'))):
+            continue
+        spans.append((start, match.end()))
+        start = match.end()
+    spans.append((start, len(text)))
+
+    stripped = []
+    for start, end in spans:
+        sentence = text[start:end]
+        if sentence.strip():
+            stripped.append((start + len(sentence) - len(sentence.lstrip()), end - len(sentence) + len(sentence.rstrip())))
+    return stripped
+
+
+def _token_windows(tokens: List[str], offsets, limit: int) -> List[Tuple[int, int]]:
+    # [first, last) token windows of at most `limit` tokens, cut before a word start (not a '##' piece)
+    # that has a character offset, when there is one in the window
+    windows = []
+    first = 0
+    while len(tokens) - first > limit:
+        cut = first + limit
+        while cut > first + 1 and (tokens[cut].startswith('##') or offsets[cut] is None):
+            cut -= 1
+        if cut == first + 1:
+            cut = first + limit
+        windows.append((first, cut))
+        first = cut
+    if first < len(tokens) or not windows:
+        windows.append((first, len(tokens)))
+    return windows
+
+
+def token_char_offsets(text: str, tokens: List[str]) -> List[Optional[Tuple[int, int]]]:
+    """
+    [start, end) character offsets in `text` of each wordpiece of `tokens` (BertTokenizer output of `text`).
+    The text is lowercased and accent-stripped per character, as BasicTokenizer does, keeping the
+    original index of every resulting character; tokens are then matched left to right.
+    """
+    chars, origin = [], []
+    for i, char in enumerate(text):
+        for norm_char in unicodedata.normalize('NFD', char.lower()):
+            if unicodedata.category(norm_char) != 'Mn':
+                chars.append(norm_char)
+                origin.append(i)
+    normalized = ''.join(chars)
+
+    offsets = []
+    position = 0
+    for token in tokens:
+        if token == UNK_TOKEN:
+            # a punctuation mark, or a whole word the vocabulary cannot spell
+            while position < len(normalized) and normalized[position].isspace():
+                position += 1
+            start = end = position
+            if end < len(normalized) and not normalized[end].isalnum():
+                end += 1
+            else:
+                while end < len(normalized) and normalized[end].isalnum():
+                    end += 1
+        else:
+            piece = token[2:] if token.startswith('##') else token
+            start = normalized.find(piece, position)
+            end = start + len(piece)
+        if start < 0 or end <= start:
+            offsets.append(None)
+            continue
+        offsets.append((origin[start], origin[end - 1] + 1))
+        position = end
+    return offsets
+
+
+def viterbi_decode(emissions, mask, start_transitions, end_transitions, transitions) -> List[List[int]]:
+    """Batched Viterbi decoding with the same semantics as torchcrf.CRF.decode (batch_first)."""
+    seq_length = emissions.size(1)
+    score = start_transitions + emissions[:, 0]
+    history = []
+    for i in range(1, seq_length):
+        next_score = score.unsqueeze(2) + transitions + emissions[:, i].unsqueeze(1)
+        next_score, indices = next_score.max(dim=1)
+        score = torch.where(mask[:, i].unsqueeze(1), next_score, score)
+        history.append(indices)
+    score = score + end_transitions
+
+    seq_ends = (mask.long().sum(dim=1) - 1).tolist()
+    best_last_tags = score.argmax(dim=1).tolist()
+    history = [indices.tolist() for indices in history]
+    best_tags_list = []
+    for b, seq_end in enumerate(seq_ends):
+        best_tags = [best_last_tags[b]]
+        for indices in reversed(history[:seq_end]):
+            best_tags.append(indices[b][best_tags[-1]])
+        best_tags.reverse()
+        best_tags_list.append(best_tags)
+    return best_tags_list
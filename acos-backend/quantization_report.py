@@ -0,0 +1,138 @@
+import io
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import logging
+from typing import List, Dict, Any, Tuple
+
+import torch
+
+from predictor import ACOS_Predictor, IMPLICIT_TEXT, SENTIMENT_NAMES
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# ACOS TEST SETS (data/*/DOMAIN_quad_test.tsv)
+ACOS_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ACOS-main', 'data')
+DOMAIN_TEST_FILES = {
+    'rest16': os.path.join(ACOS_DATA_DIR, 'Restaurant-ACOS', 'rest16_quad_test.tsv'),
+    'laptop': os.path.join(ACOS_DATA_DIR, 'Laptop-ACOS', 'laptop_quad_test.tsv'),
+}
+
+
+def _span_key(text: str) -> str:
+    # gold text is pre-tokenized on words, predictions on wordpieces; compare without whitespace
+    return ''.join(text.split())
+
+
+def read_gold(test_file: str) -> Tuple[List[str], List[set]]:
+    sentences = []
+    golds = []
+    with open(test_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n').split('\t')
+            if not line[0]:
+                continue
+            words = line[0].split(' ')
+            quads = set()
+            for quad in line[1:]:
+                aspect, category, senti, opinion = quad.split(' ')
+                a_st, a_ed = (int(x) for x in aspect.split(','))
+                o_st, o_ed = (int(x) for x in opinion.split(','))
+                aspect_text = IMPLICIT_TEXT if a_st == -1 else ' '.join(words[a_st:a_ed])
+                opinion_text = IMPLICIT_TEXT if o_st == -1 else ' '.join(words[o_st:o_ed])
+                quads.add((_span_key(aspect_text), category, SENTIMENT_NAMES[senti], _span_key(opinion_text)))
+            sentences.append(line[0])
+            golds.append(quads)
+    return sentences, golds
+
+
+def quad_set(results: List[Dict[str, Any]]) -> set:
+    return {(_span_key(q['aspect']), q['category'], q['sentiment'], _span_key(q['opinion'])) for q in results}
+
+
+def micro_f1(preds: List[set], golds: List[set]) -> Dict[str, float]:
+    tp = sum(len(p & g) for p, g in zip(preds, golds))
+    fp = sum(len(p - g) for p, g in zip(preds, golds))
+    fn = sum(len(g - p) for p, g in zip(preds, golds))
+    p = 0 if tp + fp == 0 else 1. * tp / (tp + fp)
+    r = 0 if tp + fn == 0 else 1. * tp / (tp + fn)
+    f = 0 if p + r == 0 else 2 * p * r / (p + r)
+    return {'precision': p, 'recall': r, 'micro-F1': f}
+
+
+def state_dict_mb(model) -> float:
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2 ** 20
+
+
+def evaluate(predictor: ACOS_Predictor, sentences: List[str], golds: List[set], batch_size: int):
+    preds = [None] * len(sentences)
+    start = time.perf_counter()
+    for index, results in predictor.predict_stream(sentences, batch_size=batch_size):
+        preds[index] = quad_set(results)
+    elapsed = time.perf_counter() - start
+    report = micro_f1(preds, golds)
+    report['sentences_per_sec'] = len(sentences) / elapsed if elapsed > 0 else 0.0
+    report['step1_bert_mb'] = state_dict_mb(predictor.model_step1.bert)
+    report['step2_bert_mb'] = state_dict_mb(predictor.model_step2.bert)
+    return report, preds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fp32 vs int8 dynamic quantization parity report on the ACOS test sets.")
+    parser.add_argument('--model_root', type=str, default='./Trained',
+                        help="Directory containing DOMAIN_1st / DOMAIN_2nd fine-tuned models.")
+    parser.add_argument('--domains', type=str, nargs='+', default=['rest16', 'laptop'], choices=sorted(DOMAIN_TEST_FILES))
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_threads', type=int, default=None, help="torch.set_num_threads for the timing runs.")
+    parser.add_argument('--output', type=str, default='./quantization_report.json')
+    args = parser.parse_args()
+
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+
+    report = {'num_threads': torch.get_num_threads(), 'domains': {}}
+    for domain in args.domains:
+        model_dir_step1 = os.path.join(args.model_root, f'{domain}_1st')
+        model_dir_step2 = os.path.join(args.model_root, f'{domain}_2nd')
+        if not (os.path.exists(model_dir_step1) and os.path.exists(model_dir_step2)):
+            logging.error(f"Error: trained models for '{domain}' not found under '{args.model_root}'")
+            sys.exit(1)
+        sentences, golds = read_gold(DOMAIN_TEST_FILES[domain])
+        logging.info(f"[{domain}] {len(sentences)} test sentences")
+
+        domain_report = {}
+        domain_preds = {}
+        for mode in ('fp32', 'int8'):
+            # test sentences are pre-tokenized single sentences: no segmentation, as in training and eval
+            predictor = ACOS_Predictor(model_dir_step1, model_dir_step2, domain_type=domain, quantize=(mode == 'int8'),
+                                       segment_sentences=False)
+            domain_report[mode], domain_preds[mode] = evaluate(predictor, sentences, golds, args.batch_size)
+            del predictor
+            gc.collect()
+            logging.info(f"[{domain}] {mode}: {domain_report[mode]}")
+
+        fp32, int8 = domain_report['fp32'], domain_report['int8']
+        domain_report['f1_delta'] = int8['micro-F1'] - fp32['micro-F1']
+        domain_report['speedup'] = int8['sentences_per_sec'] / fp32['sentences_per_sec'] if fp32['sentences_per_sec'] else 0.0
+        domain_report['identical_sentence_rate'] = sum(
+            p == q for p, q in zip(domain_preds['fp32'], domain_preds['int8'])) / max(len(sentences), 1)
+        report['domains'][domain] = domain_report
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    logging.info("======================================")
+    for domain, domain_report in report['domains'].items():
+        logging.info(f"  {domain}: F1 fp32 {domain_report['fp32']['micro-F1']:.4f} / int8 {domain_report['int8']['micro-F1']:.4f}"
+                     f" (delta {domain_report['f1_delta']:+.4f}), speedup x{domain_report['speedup']:.2f}")
+    logging.info(f"  Report saved to '{args.output}'")
+    logging.info("======================================")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import os
+import re
+import json
+import bisect
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable
+
+# Files whose change means a different trained model (see run_step1/run_step2 WEIGHTS_NAME, CONFIG_NAME)
+MODEL_FILES = ('config.json', 'pytorch_model.bin', 'vocab.txt')
+
+# Shape of the cached quad dicts; bumped when the predictor adds or changes fields,
+# so older entries are not served in the new format
+RESULT_FORMAT_VERSION = 3
+
+# Character [start, end) offsets in a quad; stored against normalize_text(text) in the cache
+SPAN_FIELDS = ('aspect_span', 'opinion_span')
+
+# Rows per "IN (?, ?, ...)" query: stay below SQLite's default limit of 999 host parameters
+SQLITE_MAX_PARAMS = 900
+
+
+def normalize_text(text: str) -> str:
+    # The models are uncased and whitespace-insensitive, so these variants get identical quads.
+    return ' '.join(text.lower().split())
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def _normalized_positions(text: str) -> List[int]:
+    # index in `text` of every character of normalize_text(text); non-decreasing
+    positions = []
+    for word in re.finditer(r'\S+', text):
+        if positions:
+            # the single joining space stands for the whitespace before the word
+            positions.append(word.start() - 1)
+        for i in range(word.start(), word.end()):
+            positions.extend([i] * len(text[i].lower()))
+    return positions
+
+
+def _move_spans(quads: List[Dict[str, Any]], move: Callable[[int, int], Optional[List[int]]]) -> List[Dict[str, Any]]:
+    moved = []
+    for quad in quads:
+        quad = dict(quad)
+        for field in SPAN_FIELDS:
+            if quad.get(field) is not None:
+                quad[field] = move(*quad[field])
+        moved.append(quad)
+    return moved
+
+
+def spans_to_normalized(text: str, quads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Copies of `quads` with their spans in `text` moved onto normalize_text(text)."""
+    positions = _normalized_positions(text)
+    return _move_spans(quads, lambda start, end: [bisect.bisect_left(positions, start),
+                                                  bisect.bisect_left(positions, end)])
+
+
+def spans_from_normalized(text: str, quads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Copies of `quads` with their spans in normalize_text(text) moved back onto `text`."""
+    positions = _normalized_positions(text)
+
+    def move(start, end):
+        if not 0 <= start < end <= len(positions):
+            return None
+        return [positions[start], positions[end - 1] + 1]
+    return _move_spans(quads, move)
+
+
+def remap_spans(quads: List[Dict[str, Any]], source: str, target: str) -> List[Dict[str, Any]]:
+    """
+    Quads found in `source` with their spans moved onto `target`, a text with the same normalize_text:
+    results are shared between such texts, but the spans are offsets into one of them.
+    """
+    if source == target:
+        return quads
+    return spans_from_normalized(target, spans_to_normalized(source, quads))
+
+
+def model_fingerprint(*model_dirs: str, variant: str = '') -> str:
+    """
+    Identifies a set of trained checkpoints by the size and mtime of their files,
+    so cached results are invalidated when TRAINED_MODEL_STEP1/2 are retrained or swapped
+    without hashing ~440 MB of weights on every start.
+    `variant` separates inference modes that change outputs (e.g. 'int8').
+    """
+    digest = hashlib.sha1(variant.encode('utf-8'))
+    for model_dir in model_dirs:
+        digest.update(os.path.abspath(model_dir).encode('utf-8'))
+        for name in MODEL_FILES:
+            path = os.path.join(model_dir, name)
+            if os.path.exists(path):
+                stat = os.stat(path)
+                digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Normalized-text -> ACOS quads cache: an in-memory LRU in front of a SQLite store.
+    Spans are stored against the normalized text and returned moved onto the text asked for.
+    Entries are scoped by model fingerprint and RESULT_FORMAT_VERSION; a different one never sees them.
+    Safe to share between the Flask request threads and the batching thread, and
+    across os.fork (serve.py workers): a forked child opens its own SQLite connection.
+    """
+
+    def __init__(self, db_path: str, fingerprint: str, max_memory_entries: int = 10000):
+        self.fingerprint = f"{fingerprint}:v{RESULT_FORMAT_VERSION}"
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_path = db_path
+        self._pid = os.getpid()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS acos_cache (
+            fingerprint TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            quads TEXT NOT NULL,
+            PRIMARY KEY (fingerprint, text_hash)
+        )
+        ''')
+        self._conn.commit()
+
+    def get(self, text: str) -> Optional[List[Dict[str, Any]]]:
+        return self.get_many([text])[0]
+
+    def put(self, text: str, quads: List[Dict[str, Any]]):
+        self.put_many([text], [quads])
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[Dict[str, Any]]]]:
+        keys = [text_hash(text) for text in texts]
+        results = [None] * len(texts)
+        with self._lock:
+            missing = {}
+            for i, key in enumerate(keys):
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    results[i] = spans_from_normalized(texts[i], self._memory[key])
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            missing_keys = list(missing)
+            for start in range(0, len(missing_keys), SQLITE_MAX_PARAMS):
+                chunk = missing_keys[start:start + SQLITE_MAX_PARAMS]
+                rows = self._connection().execute(
+                    "SELECT text_hash, quads FROM acos_cache WHERE fingerprint = ? AND text_hash IN ({})".format(
+                        ','.join('?' * len(chunk))),
+                    [self.fingerprint] + chunk).fetchall()
+                for key, quads in rows:
+                    quads = json.loads(quads)
+                    self._remember(key, quads)
+                    for i in missing[key]:
+                        results[i] = spans_from_normalized(texts[i], quads)
+        return results
+
+    def put_many(self, texts: List[str], quads_list: List[List[Dict[str, Any]]]):
+        rows = []
+        with self._lock:
+            for text, quads in zip(texts, quads_list):
+                key = text_hash(text)
+                quads = spans_to_normalized(text, quads)
+                self._remember(key, quads)
+                rows.append((self.fingerprint, key, json.dumps(quads, ensure_ascii=False)))
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO acos_cache (fingerprint, text_hash, quads) VALUES (?, ?, ?)", rows)
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite connections must not be used across fork; the parent's stays untouched
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._conn = sqlite3.connect(self._db_path, check_same_thread=False)
+        return self._conn
+
+    def _remember(self, key, quads):
+        self._memory[key] = quads
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
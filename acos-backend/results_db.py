@@ -0,0 +1,258 @@
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+from itertools import groupby
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+from result_cache import text_hash, SQLITE_MAX_PARAMS
+
+# REVIEWS LOADED PER TRANSACTION BY load_records
+LOAD_BATCH_SIZE = 2000
+
+
+# RESULTS DB (acos_results, progress journal and analyzed review keys)
+def open_results_db(db_path: str) -> sqlite3.Connection:
+    logging.info(f"DB Path: {db_path}")
+    conn = sqlite3.connect(db_path)
+    # readers (shard workers, app) do not block on the single writer
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS acos_results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id TEXT NOT NULL,
+        review_text TEXT,
+        aspect TEXT,
+        opinion TEXT,
+        category TEXT,
+        sentiment INTEGER
+    )
+    ''')
+    # PROGRESS JOURNAL: one row per committed chunk, written in the same transaction as its results
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS pipeline_journal (
+        source TEXT NOT NULL,
+        source_head TEXT NOT NULL,
+        chunk_id INTEGER NOT NULL,
+        start_offset INTEGER NOT NULL,
+        end_offset INTEGER NOT NULL,
+        reviews INTEGER NOT NULL,
+        quads INTEGER NOT NULL,
+        committed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (source, chunk_id)
+    )
+    ''')
+    # ANALYZED REVIEW KEYS: asin + normalized text hash of every review already in acos_results
+    # (including reviews without any quadruple), so reruns skip them before tokenization
+    has_keys = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'analyzed_reviews'").fetchone()
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS analyzed_reviews (
+        text_hash TEXT NOT NULL,
+        product_id TEXT NOT NULL,
+        PRIMARY KEY (text_hash, product_id)
+    )
+    ''')
+    if not has_keys:
+        backfill_review_keys(conn)
+    conn.commit()
+    return conn
+
+
+# Keys for results loaded before analyzed_reviews existed (reviews without quads are not recoverable)
+def backfill_review_keys(conn: sqlite3.Connection):
+    rows = conn.execute("SELECT DISTINCT product_id, review_text FROM acos_results").fetchall()
+    if rows:
+        conn.executemany("INSERT OR IGNORE INTO analyzed_reviews (text_hash, product_id) VALUES (?, ?)",
+                         [(text_hash(review_text or ''), product_id) for product_id, review_text in rows])
+        logging.info(f"Backfilled {len(rows)} analyzed review keys from acos_results")
+
+
+# DROP REVIEWS ALREADY IN THE DB (one bulk lookup per chunk; repeats within the chunk are dropped too)
+def filter_analyzed(conn: sqlite3.Connection, reviews):
+    keys = [(text_hash(text), product_id) for product_id, text in reviews]
+    hashes = list({key[0] for key in keys})
+    seen = set()
+    for start in range(0, len(hashes), SQLITE_MAX_PARAMS):
+        chunk = hashes[start:start + SQLITE_MAX_PARAMS]
+        seen.update(conn.execute(
+            "SELECT text_hash, product_id FROM analyzed_reviews WHERE text_hash IN ({})".format(','.join('?' * len(chunk))),
+            chunk).fetchall())
+
+    fresh = []
+    for review, key in zip(reviews, keys):
+        if key not in seen:
+            seen.add(key)
+            fresh.append(review)
+    return fresh
+
+
+SENTIMENT_MAP = {"Negative": 0, "Neutral": 1, "Positive": 2, "negative": 0, "neutral": 1, "positive": 2}
+
+
+# PENDING BYTE RANGES: [start, end) parts of the file not covered by a committed chunk
+def journal_pending_ranges(conn: sqlite3.Connection, source: str, source_head: str, file_size: Optional[int]):
+    rows = conn.execute("SELECT DISTINCT source_head FROM pipeline_journal WHERE source = ?", (source,)).fetchall()
+    if any(head != source_head for head, in rows):
+        logging.warning(f"Warning: '{source}' changed since the journaled run; starting from the beginning")
+        with conn:
+            conn.execute("DELETE FROM pipeline_journal WHERE source = ?", (source,))
+
+    pending = []
+    position = 0
+    for start, end in conn.execute("SELECT start_offset, end_offset FROM pipeline_journal WHERE source = ? "
+                                   "ORDER BY start_offset", (source,)):
+        if start > position:
+            pending.append((position, start))
+        position = max(position, end)
+    # file_size None (compressed input): whatever follows the last committed chunk is pending
+    if file_size is None or position < file_size:
+        pending.append((position, file_size))
+    return pending
+
+
+def next_chunk_id(conn: sqlite3.Connection, source: str) -> int:
+    return conn.execute("SELECT COALESCE(MAX(chunk_id) + 1, 0) FROM pipeline_journal WHERE source = ?",
+                        (source,)).fetchone()[0]
+
+
+# INSERT ONE CHUNK OF (product_id, review_text, quads), THEIR KEYS AND ITS JOURNAL ROW IN ONE TRANSACTION
+# A crash before the commit leaves neither, so the chunk is redone without duplicate rows.
+def commit_chunk(conn: sqlite3.Connection, reviews, journal_entry: Dict[str, Any] = None) -> int:
+    rows = [
+        (product_id, review_text, quad['aspect'], quad['opinion'], quad['category'],
+         SENTIMENT_MAP.get(quad['sentiment'], -1))
+        for product_id, review_text, quads in reviews for quad in quads
+    ]
+    with conn:
+        conn.executemany(
+            "INSERT INTO acos_results (product_id, review_text, aspect, opinion, category, sentiment) VALUES (?, ?, ?, ?, ?, ?)",
+            rows)
+        conn.executemany(
+            "INSERT OR IGNORE INTO analyzed_reviews (text_hash, product_id) VALUES (?, ?)",
+            [(text_hash(review_text), product_id) for product_id, review_text, _ in reviews])
+        if journal_entry is not None:
+            conn.execute(
+                "INSERT INTO pipeline_journal (source, source_head, chunk_id, start_offset, end_offset, reviews, quads) "
+                "VALUES (:source, :source_head, :chunk_id, :start_offset, :end_offset, :reviews, :quads)",
+                dict(journal_entry, reviews=len(reviews), quads=len(rows)))
+    return len(rows)
+
+
+# DELETE THE RESULTS AND REVIEW KEYS OF THESE PRODUCTS (left uncommitted, for the caller's next transaction)
+def delete_products(conn: sqlite3.Connection, product_ids: List[str]) -> int:
+    deleted = 0
+    for start in range(0, len(product_ids), SQLITE_MAX_PARAMS):
+        chunk = product_ids[start:start + SQLITE_MAX_PARAMS]
+        marks = ','.join('?' * len(chunk))
+        deleted += conn.execute(f"DELETE FROM acos_results WHERE product_id IN ({marks})", chunk).rowcount
+        conn.execute(f"DELETE FROM analyzed_reviews WHERE product_id IN ({marks})", chunk)
+    return deleted
+
+
+# QUAD RECORDS: one JSON object per line and quad, all quads of a review on consecutive lines.
+# A review without any quadruple gets a single record without 'category', so it is still marked analyzed.
+# Spans are [start, end) character offsets in review_text (null for an implicit aspect/opinion).
+RECORD_FIELDS = ('aspect', 'aspect_span', 'opinion', 'opinion_span', 'category', 'sentiment', 'score')
+
+
+def review_records(product_id: str, review_text: str, quads: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    if not quads:
+        yield {'asin': product_id, 'review_text': review_text}
+    for quad in quads:
+        record = {'asin': product_id, 'review_text': review_text}
+        record.update((field, quad.get(field)) for field in RECORD_FIELDS)
+        yield record
+
+
+def write_records(fout, reviews) -> int:
+    """Appends the records of (product_id, review_text, quads) reviews to an open text file."""
+    lines = [json.dumps(record, ensure_ascii=False)
+             for product_id, review_text, quads in reviews
+             for record in review_records(product_id, review_text, quads)]
+    if lines:
+        fout.write('\n'.join(lines) + '\n')
+        fout.flush()
+    return len(lines)
+
+
+# RECORDS BACK TO (product_id, review_text, quads), one review at a time
+def iter_record_reviews(fin, stats: Dict[str, int] = None) -> Iterator[Tuple[str, str, List[Dict[str, Any]]]]:
+    if stats is None:
+        stats = {}
+    stats.setdefault('records', 0)
+    stats.setdefault('errors', 0)
+
+    def parsed():
+        for line in fin:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                key = (str(record['asin']), str(record['review_text']))
+            except (ValueError, KeyError, TypeError):
+                stats['errors'] += 1
+                continue
+            stats['records'] += 1
+            yield key, record
+
+    for (product_id, review_text), group in groupby(parsed(), key=lambda item: item[0]):
+        quads = [{field: record.get(field) for field in RECORD_FIELDS}
+                 for _, record in group if record.get('category') is not None]
+        yield product_id, review_text, quads
+
+
+# LOAD A RECORD STREAM INTO THE DB, batch_size reviews per transaction
+# Only one batch is in memory; reviews already in the DB are skipped, so a partial load can be rerun.
+def load_records(conn: sqlite3.Connection, fin, batch_size: int = LOAD_BATCH_SIZE) -> Dict[str, int]:
+    totals = {'reviews': 0, 'skipped': 0, 'quads': 0}
+    stats = {}
+    batch = []
+
+    def flush():
+        fresh = set(filter_analyzed(conn, [review[:2] for review in batch]))
+        kept = []
+        for review in batch:
+            # a review repeated within the batch is kept once
+            if review[:2] in fresh:
+                fresh.discard(review[:2])
+                kept.append(review)
+        totals['quads'] += commit_chunk(conn, kept)
+        totals['reviews'] += len(batch)
+        totals['skipped'] += len(batch) - len(kept)
+        batch.clear()
+
+    for review in iter_record_reviews(fin, stats):
+        batch.append(review)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    totals.update(stats)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load ACOS quad records (NDJSON, see RECORD_FIELDS) into the results DB.")
+    parser.add_argument('records', type=str, help="Record file written by pipeline.py (RESULT_RECORDS_FILE), or '-' for stdin.")
+    parser.add_argument('--db', type=str, default='./db1.db')
+    parser.add_argument('--batch_size', type=int, default=LOAD_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    conn = open_results_db(args.db)
+    try:
+        if args.records == '-':
+            totals = load_records(conn, sys.stdin, args.batch_size)
+        else:
+            with open(args.records, 'r', encoding='utf-8') as fin:
+                totals = load_records(conn, fin, args.batch_size)
+    finally:
+        conn.close()
+    logging.info(f"Loaded {totals['records']} records: {totals['reviews']} reviews ({totals['skipped']} already in DB), "
+                 f"{totals['quads']} quadruples saved in '{args.db}' (Error: {totals['errors']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import os
+import sys
+import bisect
+import hashlib
+import sqlite3
+import argparse
+import logging
+from array import array
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
+
+from review_reader import (iter_lines, map_blocks, input_size, is_compressed, json_loads,
+                           DEFAULT_BLOCK_BYTES)
+
+# SIDECAR INDEX FILE: <review file> + INDEX_SUFFIX (SQLite)
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 2
+
+# RECORD OFFSETS PER STORED BLOB (uint64 each, so 512 KB blobs)
+BLOCK_RECORDS = 65536
+
+# Bytes at the start of a file that identify it, as in the pipeline journal
+SOURCE_HEAD_BYTES = 4096
+
+
+def index_path(path: str) -> str:
+    return path + INDEX_SUFFIX
+
+
+def _to_blob(values: array) -> bytes:
+    # stored little endian whatever the platform
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_blob(typecode: str, blob: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(blob)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def source_signature(path: str) -> Dict[str, str]:
+    """Size, mtime and head hash of a review file; an index built for other values is stale."""
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        head = hashlib.sha1(f.read(SOURCE_HEAD_BYTES)).hexdigest()
+    return {'source_size': str(stat.st_size), 'source_mtime_ns': str(stat.st_mtime_ns), 'source_head': head}
+
+
+# --- Building ---
+def index_block(path: str, start: int, end: int, by_asin: bool) -> Tuple[bytes, Optional[List[str]]]:
+    """Start offsets of the non-blank lines in [start, end) and, with by_asin, their asin ('' if unreadable)."""
+    offsets = array('Q')
+    asins = [] if by_asin else None
+    for line, line_end in iter_lines(path, start, end):
+        if not line.strip():
+            continue
+        offsets.append(line_end - len(line))
+        if by_asin:
+            try:
+                asins.append(str(json_loads(line).get('asin') or '').strip())
+            except Exception:
+                asins.append('')
+    return offsets.tobytes(), asins
+
+
+def build_index(path: str, by_asin: bool = True, processes: int = 0,
+                block_bytes: int = DEFAULT_BLOCK_BYTES) -> 'ReviewIndex':
+    """
+    Writes the sidecar index of `path`: the byte offset of every record (non-blank line), and with
+    by_asin the offsets of the records of each asin. Plain files are scanned in parallel blocks with
+    processes > 1; offsets of a compressed file are positions in its decompressed stream.
+    """
+    target = index_path(path)
+    temp = target + '.tmp'
+    if os.path.exists(temp):
+        os.remove(temp)
+    conn = sqlite3.connect(temp)
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    conn.execute("CREATE TABLE offsets (block INTEGER PRIMARY KEY, data BLOB NOT NULL)")
+    conn.execute("CREATE TABLE asins (asin TEXT PRIMARY KEY, offsets BLOB NOT NULL)")
+
+    if is_compressed(path):
+        blocks = [index_block(path, 0, None, by_asin)]
+    else:
+        blocks = map_blocks(index_block, path, 0, os.path.getsize(path), processes, block_bytes, by_asin)
+
+    pending = array('Q')
+    groups = {}
+    records = 0
+    stored_blocks = 0
+    for data, asins in blocks:
+        offsets = array('Q')
+        offsets.frombytes(data)
+        pending.extend(offsets)
+        if asins is not None:
+            for offset, asin in zip(offsets, asins):
+                if asin:
+                    groups.setdefault(asin, array('Q')).append(offset)
+        records += len(offsets)
+        while len(pending) >= BLOCK_RECORDS:
+            conn.execute("INSERT INTO offsets (block, data) VALUES (?, ?)",
+                         (stored_blocks, _to_blob(pending[:BLOCK_RECORDS])))
+            del pending[:BLOCK_RECORDS]
+            stored_blocks += 1
+    if pending:
+        conn.execute("INSERT INTO offsets (block, data) VALUES (?, ?)", (stored_blocks, _to_blob(pending)))
+    conn.executemany("INSERT INTO asins (asin, offsets) VALUES (?, ?)",
+                     ((asin, _to_blob(offsets)) for asin, offsets in groups.items()))
+
+    meta = dict(source_signature(path), version=str(INDEX_VERSION), records=str(records),
+                block_records=str(BLOCK_RECORDS), by_asin=str(int(by_asin)))
+    conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", meta.items())
+    conn.commit()
+    conn.close()
+    os.replace(temp, target)
+    return ReviewIndex(target)
+
+
+# --- Reading ---
+class ReviewIndex:
+    """
+    Random access into a review file through its sidecar index.
+    Record numbers count the non-blank lines of the file from 0.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self.meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+        self.records = int(self.meta['records'])
+        self.block_records = int(self.meta['block_records'])
+        self.has_asins = self.meta['by_asin'] == '1'
+        # first offset of every block, to find a block without loading it
+        self._block_starts = [_from_blob('Q', head)[0] for _, head in self._conn.execute(
+            "SELECT block, substr(data, 1, 8) FROM offsets ORDER BY block")]
+        self._cached_block = (None, None)
+
+    def __len__(self) -> int:
+        return self.records
+
+    def _block(self, block: int) -> array:
+        if self._cached_block[0] != block:
+            data, = self._conn.execute("SELECT data FROM offsets WHERE block = ?", (block,)).fetchone()
+            self._cached_block = (block, _from_blob('Q', data))
+        return self._cached_block[1]
+
+    def offset(self, record: int) -> int:
+        """Byte offset where `record` starts."""
+        if not 0 <= record < self.records:
+            raise IndexError(f"record {record} out of range (0-{self.records - 1})")
+        return self._block(record // self.block_records)[record % self.block_records]
+
+    def record_at_or_after(self, byte_offset: int) -> int:
+        """Number of the first record starting at or after byte_offset (len(self) if none)."""
+        block = bisect.bisect_right(self._block_starts, byte_offset) - 1
+        if block < 0:
+            return 0
+        offsets = self._block(block)
+        position = bisect.bisect_left(offsets, byte_offset)
+        return block * self.block_records + position
+
+    def iter_offsets(self) -> Iterator[array]:
+        """Offsets of all records in file order, one block of up to block_records at a time."""
+        for data, in self._conn.execute("SELECT data FROM offsets ORDER BY block"):
+            yield _from_blob('Q', data)
+
+    def asin_offsets(self, asin: str) -> List[int]:
+        """Offsets of the records of `asin`, in file order."""
+        row = self._conn.execute("SELECT offsets FROM asins WHERE asin = ?", (asin,)).fetchone()
+        return _from_blob('Q', row[0]).tolist() if row else []
+
+    def iter_asins(self) -> Iterator[Tuple[str, array]]:
+        """(asin, offsets of its records) of every indexed asin."""
+        for asin, data in self._conn.execute("SELECT asin, offsets FROM asins ORDER BY asin"):
+            yield asin, _from_blob('Q', data)
+
+    def asin_counts(self) -> Iterator[Tuple[str, int]]:
+        """(asin, number of records) of every indexed asin."""
+        for asin, size in self._conn.execute("SELECT asin, length(offsets) FROM asins ORDER BY asin"):
+            yield asin, size // 8
+
+    def close(self):
+        self._conn.close()
+
+
+def open_index(path: str, require_asins: bool = False) -> Optional[ReviewIndex]:
+    """The sidecar index of `path`, or None if there is none or it no longer matches the file."""
+    target = index_path(path)
+    if not os.path.exists(target):
+        return None
+    try:
+        index = ReviewIndex(target)
+    except (sqlite3.Error, KeyError, IndexError):
+        return None
+    signature = source_signature(path)
+    if index.meta.get('version') != str(INDEX_VERSION) or any(index.meta.get(k) != v for k, v in signature.items()) \
+            or (require_asins and not index.has_asins):
+        index.close()
+        return None
+    return index
+
+
+def read_records(path: str, offsets: Iterable[int], presorted: bool = False) -> Iterator[Tuple[int, bytes]]:
+    """
+    (offset, line) of the records starting at `offsets`, in offset order. A plain file is read with
+    one seek per record; a compressed one in a single forward pass over its decompressed stream.
+    With presorted, `offsets` is taken as ascending and without repeats and consumed lazily.
+    """
+    if not presorted:
+        offsets = sorted(set(offsets))
+    if not is_compressed(path):
+        with open(path, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                yield offset, f.readline()
+        return
+
+    wanted = iter(offsets)
+    target = next(wanted, None)
+    for line, line_end in iter_lines(path):
+        if target is None:
+            break
+        if line_end - len(line) == target:
+            yield target, line
+            target = next(wanted, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the byte-offset sidecar index (<file>.idx) of a JSONL review file.")
+    parser.add_argument('file', type=str, help="Review file (.jsonl, or .jsonl.gz / .bz2 / .zst).")
+    parser.add_argument('--no_asin', action='store_true', help="Index record offsets only, without per-asin groups.")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help="Parallel scan processes (plain files only).")
+    parser.add_argument('--asin', type=str, nargs='+', default=None,
+                        help="Print the records of these asins instead of building (the index is built if missing).")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if not os.path.exists(args.file):
+        logging.error(f"Error: File not Found: '{args.file}'")
+        sys.exit(1)
+
+    index = open_index(args.file, require_asins=bool(args.asin))
+    if index is None or not args.asin:
+        logging.info(f"Indexing '{args.file}' ({input_size(args.file) or 'compressed'} bytes)...")
+        index = build_index(args.file, by_asin=not args.no_asin, processes=args.processes)
+        logging.info(f"Index saved to '{index.path}': {len(index)} records")
+    if args.asin:
+        offsets = [offset for asin in args.asin for offset in index.asin_offsets(asin)]
+        for _, line in read_records(args.file, offsets):
+            sys.stdout.write(line.decode('utf-8'))
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
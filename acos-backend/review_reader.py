@@ -0,0 +1,291 @@
+import io
+import os
+import bz2
+import gzip
+import json
+import queue
+import shutil
+import threading
+import subprocess
+import multiprocessing
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, List, Dict, Iterator, Optional, Tuple
+
+# JSON BACKEND: orjson when installed (several times faster on long review lines), stdlib json otherwise
+try:
+    import orjson
+    json_loads = orjson.loads
+    JSON_BACKEND = 'orjson'
+except ImportError:
+    json_loads = json.loads
+    JSON_BACKEND = 'json'
+
+# BYTES PER PARSE TASK OF THE PARALLEL READER (cut at the next line start)
+DEFAULT_BLOCK_BYTES = 8 * 2 ** 20
+
+# COMPRESSED INPUTS: decompressed as a stream by an external tool (a separate process, first one found on PATH),
+# or in a background thread of this process (zstd needs the optional zstandard package)
+EXTERNAL_DECOMPRESSORS = {
+    '.gz': (('pigz', '-dc'), ('gzip', '-dc')),
+    '.bz2': (('lbzip2', '-dc'), ('pbzip2', '-dc'), ('bzip2', '-dc')),
+    '.zst': (('zstd', '-dc'),),
+}
+COMPRESSED_SUFFIXES = tuple(EXTERNAL_DECOMPRESSORS) + ('.zstd',)
+
+# DECOMPRESSED BYTES PER READ OF THE BACKGROUND DECOMPRESSION THREAD, AND BLOCKS BUFFERED AHEAD
+STREAM_BLOCK_BYTES = 2 ** 20
+STREAM_PREFETCH_BLOCKS = 8
+
+
+# --- Compressed streams ---
+def compression_suffix(path: str) -> Optional[str]:
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == '.zstd':
+        return '.zst'
+    return suffix if suffix in EXTERNAL_DECOMPRESSORS else None
+
+
+def is_compressed(path: str) -> bool:
+    return compression_suffix(path) is not None
+
+
+def input_size(path: str) -> Optional[int]:
+    """Size of the (decompressed) review stream in bytes, or None when it is only known by reading it all."""
+    return None if is_compressed(path) else os.path.getsize(path)
+
+
+class ThreadedReader(io.RawIOBase):
+    """
+    Reads `source` on a background thread, at most STREAM_PREFETCH_BLOCKS blocks ahead.
+    zlib, bz2 and zstandard release the GIL while decompressing, so decompression overlaps
+    with the JSON parsing done by the consumer.
+    """
+
+    def __init__(self, source, block_bytes: int = STREAM_BLOCK_BYTES, depth: int = STREAM_PREFETCH_BLOCKS):
+        super(ThreadedReader, self).__init__()
+        self._source = source
+        self._queue = queue.Queue(maxsize=depth)
+        self._buffer = memoryview(b'')
+        self._eof = False
+        self._stop = False
+        self._thread = threading.Thread(target=self._produce, args=(block_bytes,), name='acos-decompress', daemon=True)
+        self._thread.start()
+
+    def _produce(self, block_bytes: int):
+        try:
+            while not self._stop:
+                block = self._source.read(block_bytes)
+                self._queue.put(block)
+                if not block:
+                    break
+        except BaseException as e:
+            self._queue.put(e)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if not self._buffer:
+            if self._eof:
+                return 0
+            block = self._queue.get()
+            if isinstance(block, BaseException):
+                raise block
+            if not block:
+                self._eof = True
+                return 0
+            self._buffer = memoryview(block)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop = True
+            # unblock a producer waiting on a full queue
+            while self._thread.is_alive():
+                try:
+                    self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self._source.close()
+        super(ThreadedReader, self).close()
+
+
+def _open_in_process(path: str, suffix: str):
+    if suffix == '.gz':
+        return gzip.open(path, 'rb')
+    if suffix == '.bz2':
+        return bz2.open(path, 'rb')
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError(f"Reading '{path}' needs the zstd command or the zstandard package (pip install zstandard)")
+    return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+
+
+@contextmanager
+def open_review_stream(path: str, start: int = 0):
+    """
+    Binary line-iterable review file positioned at `start`. Compressed files (see COMPRESSED_SUFFIXES)
+    are decompressed on the fly; `start` is then an offset in the decompressed stream, reached by
+    decompressing and discarding everything before it.
+    """
+    suffix = compression_suffix(path)
+    if suffix is None:
+        with open(path, 'rb') as f:
+            f.seek(start)
+            yield f
+        return
+
+    process = None
+    command = next((command for command in EXTERNAL_DECOMPRESSORS[suffix] if shutil.which(command[0])), None)
+    if command is not None:
+        process = subprocess.Popen(list(command) + [path], stdout=subprocess.PIPE, bufsize=STREAM_BLOCK_BYTES)
+        stream = process.stdout
+    else:
+        stream = io.BufferedReader(ThreadedReader(_open_in_process(path, suffix)), buffer_size=STREAM_BLOCK_BYTES)
+    try:
+        remaining = start
+        while remaining > 0:
+            skipped = len(stream.read(min(remaining, STREAM_BLOCK_BYTES)))
+            if not skipped:
+                break
+            remaining -= skipped
+        yield stream
+        if process is not None and not stream.peek(1):
+            # read to the end: a failed decompression must not pass for a shorter file
+            if process.wait() != 0:
+                raise RuntimeError(f"{command[0]} failed on '{path}' (exit code {process.returncode})")
+    finally:
+        stream.close()
+        if process is not None and process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def parse_review(line: bytes) -> Optional[Tuple[str, str]]:
+    """(asin, text) of one JSONL review line, cleaned as the pipeline stores them, or None if unusable."""
+    try:
+        data = json_loads(line)
+        product_id = data.get("asin")
+        text = data.get("text")
+        if not product_id or not text or text.isspace():
+            return None
+        return str(product_id).strip(), str(text).strip().replace('\n', ' ').replace('\t', ' ')
+    except Exception:
+        return None
+
+
+def iter_lines(path: str, start: int = 0, end: int = None) -> Iterator[Tuple[bytes, int]]:
+    """(line, offset after the line) for the lines starting in [start, end) of a (possibly compressed) file."""
+    offset = start
+    with open_review_stream(path, start) as fin:
+        for line in fin:
+            # lines starting at or after end belong to the next range
+            if end is not None and offset >= end:
+                break
+            offset += len(line)
+            yield line, offset
+
+
+def parse_range(path: str, start: int, end: int) -> Tuple[List[Tuple[str, str, int]], int]:
+    """(asin, text, offset after its line) of the reviews in [start, end), and the number of unusable lines."""
+    reviews = []
+    errors = 0
+    for line, line_end in iter_lines(path, start, end):
+        if not line.strip():
+            continue
+        review = parse_review(line)
+        if review is None:
+            errors += 1
+        else:
+            reviews.append(review + (line_end,))
+    return reviews, errors
+
+
+def split_blocks(path: str, start: int, end: int, block_bytes: int = DEFAULT_BLOCK_BYTES) -> Iterator[Tuple[int, int]]:
+    """Newline-aligned [start, end) blocks of about block_bytes covering [start, end)."""
+    with open(path, 'rb') as f:
+        while start < end:
+            cut = end
+            if start + block_bytes < end:
+                # move the cut to the start of the next line
+                f.seek(start + block_bytes - 1)
+                f.readline()
+                cut = min(f.tell(), end)
+            yield start, cut
+            start = cut
+
+
+def spawn_context():
+    """Multiprocessing context of every worker pool in the pipeline."""
+    # spawn: workers start from a clean interpreter instead of a fork of this process's threads and torch state
+    return multiprocessing.get_context('spawn')
+
+
+def map_blocks(func, path: str, start: int, end: int, processes: int = 0, block_bytes: int = DEFAULT_BLOCK_BYTES,
+               *args) -> Iterator[Any]:
+    """
+    func(path, block_start, block_end, *args) over the newline-aligned blocks of [start, end), in order.
+    With processes > 1 the blocks run in spawned worker processes, at most 2 * processes in flight,
+    so memory stays bounded however far the consumer lags behind.
+    """
+    if processes <= 1:
+        for block_start, block_end in split_blocks(path, start, end, block_bytes):
+            yield func(path, block_start, block_end, *args)
+        return
+
+    pool = ProcessPoolExecutor(processes, mp_context=spawn_context())
+    in_flight = deque()
+    try:
+        blocks = split_blocks(path, start, end, block_bytes)
+        while True:
+            for block_start, block_end in blocks:
+                in_flight.append(pool.submit(func, path, block_start, block_end, *args))
+                if len(in_flight) >= 2 * processes:
+                    break
+            if not in_flight:
+                break
+            yield in_flight.popleft().result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+
+def iter_reviews(path: str, start: int = 0, end: int = None, stats: Dict[str, int] = None, processes: int = 0,
+                 block_bytes: int = DEFAULT_BLOCK_BYTES) -> Iterator[Tuple[str, str, int]]:
+    """
+    Yields (asin, text, offset after its line) for the reviews in [start, end), in file order.
+
+    With processes > 1 the range is cut into newline-aligned blocks that are decoded in parallel
+    worker processes (see map_blocks); only the two projected fields are sent back. Compressed files
+    cannot be cut into blocks and are always read as one stream.
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault('reviews', 0)
+    stats.setdefault('errors', 0)
+    if end is None:
+        end = input_size(path)
+
+    if processes <= 1 or is_compressed(path):
+        for line, line_end in iter_lines(path, start, end):
+            if not line.strip():
+                continue
+            review = parse_review(line)
+            if review is None:
+                stats['errors'] += 1
+                continue
+            stats['reviews'] += 1
+            yield review + (line_end,)
+        return
+
+    for reviews, errors in map_blocks(parse_range, path, start, end, processes, block_bytes):
+        stats['errors'] += errors
+        stats['reviews'] += len(reviews)
+        yield from reviews
@@ -0,0 +1,113 @@
+import os
+import gc
+import sys
+import time
+import signal
+import argparse
+import logging
+
+import torch
+from werkzeug.serving import make_server
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# A worker that dies sooner than this after being spawned is treated as a startup failure, not respawned.
+MIN_WORKER_UPTIME = 5.0
+
+
+def _default_threads(workers: int) -> int:
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def _run_worker(server, num_threads: int):
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    torch.set_num_threads(num_threads)
+    logging.info(f"Worker {os.getpid()} serving with {num_threads} torch threads")
+    try:
+        server.serve_forever()
+    finally:
+        os._exit(0)
+
+
+def _spawn(server, num_threads: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        _run_worker(server, num_threads)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pre-forked ACOS API server: models are loaded once, workers share the weights copy-on-write.")
+    parser.add_argument('--host', type=str, default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=None,
+                        help="torch.set_num_threads per worker (default: cpu_count // workers).")
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        logging.error("Error: pre-forked serving requires os.fork (Linux/macOS); use 'python app.py' instead.")
+        sys.exit(1)
+    if args.workers < 1:
+        logging.error(f"Error: --workers should be >= 1, got {args.workers}")
+        sys.exit(1)
+    num_threads = args.threads or _default_threads(args.workers)
+
+    # Importing app loads both models in this (parent) process, before any fork.
+    from app import app, predictor
+    if predictor is None:
+        logging.warning("No trained model loaded; workers will answer '/analyze' with example data.")
+
+    # Bind once so all workers accept() on the same listening socket.
+    server = make_server(args.host, args.port, app, threaded=True)
+
+    # Move everything allocated so far out of the GC's reach: collections would otherwise write to
+    # every tracked object's header and un-share those pages in each worker. Tensor storage is never
+    # written after loading, so the ~880 MB of weights stay shared between all workers.
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+    workers = {}
+    for _ in range(args.workers):
+        workers[_spawn(server, num_threads)] = time.monotonic()
+    logging.info(f"Serving on http://{args.host}:{args.port} with {args.workers} workers x {num_threads} threads")
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        if time.monotonic() - started < MIN_WORKER_UPTIME:
+            logging.error(f"Worker {pid} exited during startup (status {status}); not respawning")
+            continue
+        logging.warning(f"Worker {pid} exited (status {status}); respawning")
+        workers[_spawn(server, num_threads)] = time.monotonic()
+
+    server.server_close()
+    logging.info("All workers stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import resource
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any
+
+# COUNTERS KEPT PER STAGE (summed over calls, threads and worker processes)
+COUNTERS = ('calls', 'wall_seconds', 'cpu_seconds', 'items_in', 'items_out', 'tokens', 'padded_tokens')
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss_mb() -> float:
+    # /proc is Linux only; elsewhere the peak so far is the closest cheap measure
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / 2 ** 20
+    except (OSError, IndexError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    return resource.getrusage(who).ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+
+
+class StageMetrics:
+    """
+    Per-stage wall time, CPU time, item/token counters and memory of a pipeline run.
+
+    `stage(name, items_in)` times one call of a stage on the calling thread; the caller fills
+    'items_out', 'tokens' and 'padded_tokens' of the yielded dict. CPU time is that of the calling
+    thread, so stages running concurrently on the reader, inference and writer threads do not count
+    each other. Worker processes send `snapshot()` to the parent, which `merge`s it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = OrderedDict()
+
+    @contextmanager
+    def stage(self, name: str, items_in: int = 0):
+        counts = {'items_in': items_in, 'items_out': 0, 'tokens': 0, 'padded_tokens': 0}
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield counts
+        finally:
+            counts['wall_seconds'] = time.perf_counter() - wall
+            counts['cpu_seconds'] = time.thread_time() - cpu
+            counts['calls'] = 1
+            rss = current_rss_mb()
+            with self._lock:
+                self._add(name, counts, rss)
+
+    def merge(self, snapshot: Dict[str, Dict[str, Any]]):
+        with self._lock:
+            for name, counts in snapshot.items():
+                self._add(name, counts, counts.get('peak_rss_mb', 0.0))
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: dict(counts) for name, counts in self.stages.items()}
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        stages = self.snapshot()
+        for counts in stages.values():
+            wall = counts['wall_seconds']
+            counts['items_per_sec'] = counts['items_in'] / wall if wall > 0 else 0.0
+            counts['cpu_utilization'] = counts['cpu_seconds'] / wall if wall > 0 else 0.0
+        return stages
+
+    def _add(self, name: str, counts: Dict[str, Any], rss: float):
+        total = self.stages.setdefault(name, dict({counter: 0 for counter in COUNTERS}, peak_rss_mb=0.0))
+        for counter in COUNTERS:
+            total[counter] += counts.get(counter, 0)
+        total['peak_rss_mb'] = max(total['peak_rss_mb'], rss)
+
+
+@contextmanager
+def measure(metrics: StageMetrics, name: str, items_in: int = 0):
+    """`metrics.stage(name, items_in)`, or a no-op when metrics is None."""
+    if metrics is None:
+        yield {}
+    else:
+        with metrics.stage(name, items_in) as counts:
+            yield counts
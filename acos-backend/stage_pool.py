@@ -0,0 +1,241 @@
+import os
+import time
+import queue
+import logging
+import traceback
+from typing import Any, Dict, List, Tuple
+
+from stage_metrics import StageMetrics, measure
+from review_reader import spawn_context
+
+STEP1 = 'step1'
+STEP2 = 'step2'
+STAGES = (STEP1, STEP2)
+
+
+# --- Worker processes ---
+def _load_stage_model(predictor_kwargs: Dict[str, Any], stage: str, num_threads: int, with_metrics: bool):
+    import torch
+    torch.set_num_threads(num_threads)
+    from predictor import ACOS_Predictor
+    metrics = StageMetrics() if with_metrics else None
+    with measure(metrics, 'model_load'):
+        predictor = ACOS_Predictor(stages=(1,) if stage == STEP1 else (2,), **predictor_kwargs)
+    predictor.metrics = metrics
+    return predictor
+
+
+def _send_metrics(predictor, stage: str, result_queue):
+    # on the way out, so the parent's run report includes this worker's stages
+    if predictor.metrics is not None:
+        result_queue.put(('metrics', stage, 0, 0, predictor.metrics.snapshot()))
+
+
+def step1_worker(predictor_kwargs: Dict[str, Any], num_threads: int, step2_batch_size: int,
+                 step1_queue, step2_queue, result_queue, with_metrics: bool = False):
+    """
+    Tags (keys, encoded) batches and forwards their candidate pairs to step 2, packing whole
+    sentences into tasks of about step2_batch_size pairs. Sentences without any candidate pair
+    are final here and go straight to result_queue.
+    """
+    try:
+        predictor = _load_stage_model(predictor_kwargs, STEP1, num_threads, with_metrics)
+        while True:
+            task = step1_queue.get()
+            if task is None:
+                _send_metrics(predictor, STEP1, result_queue)
+                break
+            keys, encoded = task
+            start = time.perf_counter()
+            pairs = predictor.extract_pairs(encoded)
+            busy = time.perf_counter() - start
+
+            by_sentence = {}
+            for index, aspect, opinion in pairs:
+                by_sentence.setdefault(index, []).append((aspect, opinion))
+            finished = [(keys[i], []) for i in range(len(encoded)) if i not in by_sentence]
+            result_queue.put(('result', STEP1, len(encoded), busy, finished))
+
+            task_keys, task_encoded, task_pairs = [], [], []
+            for index, sentence_pairs in by_sentence.items():
+                task_pairs.extend((len(task_encoded), aspect, opinion) for aspect, opinion in sentence_pairs)
+                task_keys.append(keys[index])
+                task_encoded.append(encoded[index])
+                if len(task_pairs) >= step2_batch_size:
+                    step2_queue.put((task_keys, task_encoded, task_pairs))
+                    task_keys, task_encoded, task_pairs = [], [], []
+            if task_pairs:
+                step2_queue.put((task_keys, task_encoded, task_pairs))
+    except Exception:
+        result_queue.put(('error', STEP1, os.getpid(), 0, traceback.format_exc()))
+
+
+def step2_worker(predictor_kwargs: Dict[str, Any], num_threads: int, step2_queue, result_queue,
+                 with_metrics: bool = False):
+    """Classifies step-1 candidate pairs and sends the finished (key, quads) of each sentence."""
+    try:
+        predictor = _load_stage_model(predictor_kwargs, STEP2, num_threads, with_metrics)
+        while True:
+            task = step2_queue.get()
+            if task is None:
+                _send_metrics(predictor, STEP2, result_queue)
+                break
+            keys, encoded, pairs = task
+            start = time.perf_counter()
+            quads = predictor.classify_pairs(encoded, pairs)
+            busy = time.perf_counter() - start
+            result_queue.put(('result', STEP2, len(encoded), busy, list(zip(keys, quads))))
+    except Exception:
+        result_queue.put(('error', STEP2, os.getpid(), 0, traceback.format_exc()))
+
+
+# --- Scheduling ---
+class StageScheduler:
+    """
+    Splits a fixed worker budget between step 1 and step 2 in proportion to their share of the work.
+
+    Workers report the busy seconds of each task. The total busy seconds of each stage are
+    smoothed over rebalance windows; a stage that does twice the work of the other gets twice
+    the workers. Step 2 only sees the sentences with candidate pairs, so its share already
+    reflects that fraction rather than a per-sentence cost.
+    """
+
+    def __init__(self, total_workers: int, smoothing: float = 0.5):
+        self.total_workers = total_workers
+        self.smoothing = smoothing
+        self.load = {stage: None for stage in STAGES}
+        self._window = {stage: 0.0 for stage in STAGES}
+
+    def observe(self, stage: str, busy_seconds: float):
+        self._window[stage] += busy_seconds
+
+    def target(self, current: Dict[str, int]) -> Dict[str, int]:
+        # a window without any finished task says nothing about the split
+        if sum(self._window.values()) > 0:
+            for stage in STAGES:
+                busy = self._window[stage]
+                previous = self.load[stage]
+                self.load[stage] = busy if previous is None else self.smoothing * busy + (1 - self.smoothing) * previous
+                self._window[stage] = 0.0
+        if None in self.load.values() or sum(self.load.values()) <= 0:
+            return dict(current)
+
+        step1 = round(self.total_workers * self.load[STEP1] / (self.load[STEP1] + self.load[STEP2]))
+        step1 = min(max(step1, 1), self.total_workers - 1)
+        return {STEP1: step1, STEP2: self.total_workers - step1}
+
+
+class StagePools:
+    """
+    Separate step-1 and step-2 process pools connected by a bounded queue.
+
+    `submit` queues a step-1 batch of (keys, encoded sentences); `poll` returns finished
+    (key, quads). `rebalance` moves at most one worker per call toward StageScheduler's split.
+    Each worker loads only its own stage's model. With `metrics`, the stage timings of every
+    worker are merged into it when the worker exits.
+    """
+
+    def __init__(self, predictor_kwargs: Dict[str, Any], total_workers: int, step2_batch_size: int,
+                 num_threads: int, queue_size: int, metrics: StageMetrics = None):
+        if total_workers < 2:
+            raise ValueError("Stage-parallel execution needs at least 2 workers, got {}".format(total_workers))
+        self.predictor_kwargs = predictor_kwargs
+        self.step2_batch_size = step2_batch_size
+        self.num_threads = num_threads
+        self.metrics = metrics
+        self.scheduler = StageScheduler(total_workers)
+
+        self._context = spawn_context()
+        self.step1_queue = self._context.Queue(maxsize=queue_size)
+        self.step2_queue = self._context.Queue(maxsize=queue_size)
+        # unbounded: workers must never block on results while the parent blocks on submit
+        self.result_queue = self._context.Queue()
+        self.workers = {stage: [] for stage in STAGES}
+        self._retiring = {stage: 0 for stage in STAGES}
+        for _ in range(total_workers // 2):
+            self._start(STEP1)
+        for _ in range(total_workers - total_workers // 2):
+            self._start(STEP2)
+
+    def submit(self, keys: List[Any], encoded: List[tuple]):
+        self.step1_queue.put((keys, encoded))
+
+    def poll(self, timeout: float) -> List[Tuple[Any, List[Dict[str, Any]]]]:
+        finished = []
+        try:
+            message = self.result_queue.get(timeout=timeout)
+            while True:
+                kind, stage, sentences, busy, payload = message
+                if kind == 'error':
+                    raise RuntimeError(f"{stage} worker {sentences} failed:\n{payload}")
+                if kind == 'metrics':
+                    if self.metrics is not None:
+                        self.metrics.merge(payload)
+                else:
+                    self.scheduler.observe(stage, busy)
+                    finished.extend(payload)
+                message = self.result_queue.get_nowait()
+        except queue.Empty:
+            pass
+        return finished
+
+    def check_workers(self):
+        for stage in STAGES:
+            for worker in [w for w in self.workers[stage] if not w.is_alive()]:
+                self.workers[stage].remove(worker)
+                if worker.exitcode == 0 and self._retiring[stage]:
+                    self._retiring[stage] -= 1
+                else:
+                    raise RuntimeError(f"{stage} worker {worker.pid} exited with code {worker.exitcode}")
+
+    def sizes(self) -> Dict[str, int]:
+        return {stage: len(self.workers[stage]) - self._retiring[stage] for stage in STAGES}
+
+    def rebalance(self):
+        current = self.sizes()
+        target = self.scheduler.target(current)
+        for grow, shrink in ((STEP1, STEP2), (STEP2, STEP1)):
+            if target[grow] > current[grow] and current[shrink] > 1:
+                self._retire(shrink)
+                self._start(grow)
+                logging.info(f"Rebalanced stage pools to {self.sizes()} "
+                             f"(busy seconds per window: step1 {self.scheduler.load[STEP1]:.2f}, "
+                             f"step2 {self.scheduler.load[STEP2]:.2f})")
+                return
+
+    def close(self):
+        for stage, stage_queue in ((STEP1, self.step1_queue), (STEP2, self.step2_queue)):
+            for _ in self.workers[stage]:
+                stage_queue.put(None)
+        workers = [worker for stage in STAGES for worker in self.workers[stage]]
+        # exiting workers send their metrics; keep reading so none blocks on a full result pipe
+        while any(worker.is_alive() for worker in workers):
+            self.poll(timeout=0.1)
+        self.poll(timeout=0.1)
+        for worker in workers:
+            worker.join()
+        for stage in STAGES:
+            self.workers[stage] = []
+
+    def terminate(self):
+        for stage in STAGES:
+            for worker in self.workers[stage]:
+                worker.terminate()
+            self.workers[stage] = []
+
+    def _start(self, stage: str):
+        if stage == STEP1:
+            target, args = step1_worker, (self.predictor_kwargs, self.num_threads, self.step2_batch_size,
+                                          self.step1_queue, self.step2_queue, self.result_queue,
+                                          self.metrics is not None)
+        else:
+            target, args = step2_worker, (self.predictor_kwargs, self.num_threads, self.step2_queue, self.result_queue,
+                                          self.metrics is not None)
+        worker = self._context.Process(target=target, args=args, name=f'acos-{stage}', daemon=True)
+        worker.start()
+        self.workers[stage].append(worker)
+
+    def _retire(self, stage: str):
+        # any idle worker of the stage takes the sentinel and exits
+        self._retiring[stage] += 1
+        (self.step1_queue if stage == STEP1 else self.step2_queue).put(None)
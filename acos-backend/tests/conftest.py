@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the backend modules are flat scripts in acos-backend/, imported by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
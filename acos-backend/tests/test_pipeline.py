@@ -0,0 +1,60 @@
+import pytest
+
+pytest.importorskip('torch')
+
+import pipeline
+from predictor import ACOS_Predictor
+from review_index import build_index
+from test_result_cache import ORIGINAL, VARIANT, quads_for, span_texts
+
+
+def test_merge_reviews_remaps_spans_onto_each_duplicate_review():
+    new_reviews = [('P1', VARIANT), ('P2', ORIGINAL)]
+    texts = list({pipeline.normalize_text(text): text for _, text in new_reviews}.values())
+    assert len(texts) == 1
+
+    # one segment for the single analyzed text, its spans measured against that text
+    merged = pipeline.merge_reviews(ACOS_Predictor, new_reviews, texts, [(0, 0)], [quads_for(texts[0])])
+    assert [(product_id, text) for product_id, text, _ in merged] == new_reviews
+    for _, text, quads in merged:
+        assert quads == quads_for(text)
+    assert span_texts(ORIGINAL, merged[1][2]) == [('Battery', 'Great'), (None, 'dim')]
+
+
+def write_reviews(path, lines):
+    with open(path, 'w') as f:
+        f.writelines(lines)
+    return [len(line) for line in lines]
+
+
+def covered(shards):
+    merged = []
+    for start, end in sorted(r for ranges in shards for r in ranges):
+        if merged and merged[-1][1] == start:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+@pytest.mark.parametrize('with_index', [False, True])
+@pytest.mark.parametrize('num_shards', [1, 2, 3, 5])
+def test_shard_ranges_cover_every_pending_byte(tmp_path, with_index, num_shards):
+    path = str(tmp_path / 'reviews.jsonl')
+    review = '{"asin": "A", "text": "fine"}\n'
+    lines = ['\n', '\n'] + [review] * 40 + ['\n'] * 3 + [review] * 40 + ['\n', '\n']
+    write_reviews(path, lines)
+    size = sum(len(line) for line in lines)
+    first_review = 2
+    blank_run = sum(len(line) for line in lines[:42])
+    # blank-only ranges at the start, in the middle and at the end, next to ranges with records
+    pending = [(0, first_review), (first_review, 100), (100, blank_run), (blank_run, blank_run + 3),
+               (blank_run + 3, size - 2), (size - 2, size)]
+    if with_index:
+        build_index(path).close()
+
+    shards = pipeline.shard_ranges(path, pending, num_shards)
+    assert covered(shards) == [(0, size)]
+    assert all(shards)
+    for ranges in shards:
+        assert ranges == sorted(ranges)
@@ -0,0 +1,50 @@
+from result_cache import ResultCache, normalize_text, remap_spans
+
+ORIGINAL = "Great  Battery,\tbut the SCREEN is dim."
+VARIANT = "great battery, but the screen is dim."
+
+
+def quads_for(text):
+    lowered = text.lower()
+    aspect = lowered.index('battery')
+    opinion = lowered.index('great')
+    return [{'aspect': 'battery', 'aspect_span': [aspect, aspect + len('battery')],
+             'opinion': 'great', 'opinion_span': [opinion, opinion + len('great')],
+             'category': 'BATTERY#GENERAL', 'sentiment': 'positive', 'score': 0.9},
+            {'aspect': 'NULL', 'aspect_span': None, 'opinion': 'dim',
+             'opinion_span': [lowered.index('dim'), lowered.index('dim') + 3],
+             'category': 'DISPLAY#QUALITY', 'sentiment': 'negative', 'score': 0.8}]
+
+
+def span_texts(text, quads):
+    return [(text[q['aspect_span'][0]:q['aspect_span'][1]] if q['aspect_span'] else None,
+             text[q['opinion_span'][0]:q['opinion_span'][1]]) for q in quads]
+
+
+def test_variants_share_a_normalized_text():
+    assert normalize_text(ORIGINAL) == normalize_text(VARIANT)
+
+
+def test_remap_spans_moves_offsets_onto_the_variant():
+    remapped = remap_spans(quads_for(VARIANT), VARIANT, ORIGINAL)
+    assert span_texts(ORIGINAL, remapped) == [('Battery', 'Great'), (None, 'dim')]
+    assert remapped == quads_for(ORIGINAL)
+
+
+def test_remap_spans_leaves_the_source_quads_untouched():
+    quads = quads_for(ORIGINAL)
+    remap_spans(quads, ORIGINAL, VARIANT)
+    assert quads == quads_for(ORIGINAL)
+
+
+def test_cache_hit_spans_point_into_the_text_asked_for(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache.db'), 'model')
+    cache.put(VARIANT, quads_for(VARIANT))
+    assert cache.get(ORIGINAL) == quads_for(ORIGINAL)
+    assert cache.get(VARIANT) == quads_for(VARIANT)
+
+    # from SQLite, past the in-memory LRU
+    fresh = ResultCache(str(tmp_path / 'cache.db'), 'model', max_memory_entries=0)
+    assert fresh.get_many([ORIGINAL, VARIANT]) == [quads_for(ORIGINAL), quads_for(VARIANT)]
+    cache.close()
+    fresh.close()
@@ -0,0 +1,40 @@
+from stage_pool import StageScheduler, STEP1, STEP2
+
+
+def feed(scheduler, step1_sentences, step2_sentences, step1_cost, step2_cost):
+    # one busy-seconds report per sentence, as if every task held a single sentence
+    for _ in range(step1_sentences):
+        scheduler.observe(STEP1, step1_cost)
+    for _ in range(step2_sentences):
+        scheduler.observe(STEP2, step2_cost)
+
+
+def test_keeps_the_current_split_until_work_is_observed():
+    scheduler = StageScheduler(6)
+    assert scheduler.target({STEP1: 3, STEP2: 3}) == {STEP1: 3, STEP2: 3}
+
+
+def test_balances_on_work_share_when_only_some_sentences_have_pairs():
+    # step 2 costs twice as much per sentence but sees only 1 sentence in 10
+    scheduler = StageScheduler(6)
+    feed(scheduler, 100, 10, 0.01, 0.02)
+    assert scheduler.target({STEP1: 3, STEP2: 3}) == {STEP1: 5, STEP2: 1}
+
+
+def test_balances_on_work_share_when_every_sentence_has_pairs():
+    scheduler = StageScheduler(6)
+    feed(scheduler, 100, 100, 0.01, 0.02)
+    assert scheduler.target({STEP1: 3, STEP2: 3}) == {STEP1: 2, STEP2: 4}
+
+
+def test_each_stage_keeps_at_least_one_worker():
+    scheduler = StageScheduler(4)
+    feed(scheduler, 100, 0, 0.01, 0.0)
+    assert scheduler.target({STEP1: 2, STEP2: 2}) == {STEP1: 3, STEP2: 1}
+
+
+def test_an_idle_window_does_not_move_the_split():
+    scheduler = StageScheduler(6)
+    feed(scheduler, 100, 10, 0.01, 0.02)
+    first = scheduler.target({STEP1: 3, STEP2: 3})
+    assert scheduler.target(first) == first